@@ -0,0 +1,83 @@
+"""
+成绩单写库：ORM 逐行写入 与 批量写入 对比
+
+以一份 60 门课程的成绩单为例，分别测量
+    orm   每门课程一个 Achievement 对象，db.session.add / db.session.delete 逐行处理
+    bulk  一条 DELETE 加一条多行 INSERT
+
+默认使用内存 SQLite，可通过环境变量 DATABASE_URL 指向 MySQL
+
+    PYTHONPATH=. python benchmarks/bulk_write.py
+"""
+from os import getenv
+from time import perf_counter
+
+from flask import Flask
+
+from nfu.expand.bulk import bulk_delete, bulk_insert
+from nfu.extensions import db
+from nfu.models import Achievement
+
+COURSES = 60
+ROUNDS = 50
+USER_ID = 181000000
+
+
+def make_rows() -> list:
+    return [{
+        'user_id': USER_ID,
+        'school_year': 2018 + i // 16,
+        'semester': i // 8 % 2 + 1,
+        'course_type': '必修',
+        'subdivision_type': '专业核心课',
+        'course_name': f'课程{i}',
+        'course_id': f'2018-2019-1-{i:05d}',
+        'credit': 3.0,
+        'achievement_point': 3.5,
+        'final_achievements': 85.0,
+        'total_achievements': 86.0,
+        'midterm_achievements': 80.0,
+        'practice_achievements': 90.0,
+        'peacetime_achievements': 88.0,
+        'resit_exam_achievement_point': None
+    } for i in range(COURSES)]
+
+
+def orm_write(rows):
+    for course in Achievement.query.filter_by(user_id=USER_ID).all():
+        db.session.delete(course)
+    db.session.commit()
+
+    for row in rows:
+        db.session.add(Achievement(**row))
+    db.session.commit()
+
+
+def bulk_write(rows):
+    bulk_delete(Achievement, user_id=USER_ID)
+    bulk_insert(Achievement, rows)
+    db.session.commit()
+
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = getenv('DATABASE_URL', 'sqlite://')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    with app.app_context():
+        Achievement.__table__.create(db.engine, checkfirst=True)
+        rows = make_rows()
+
+        for name, func in (('orm', orm_write), ('bulk', bulk_write)):
+            func(rows)
+
+            start = perf_counter()
+            for _ in range(ROUNDS):
+                func(rows)
+            elapsed = perf_counter() - start
+
+            print(f'{name:<5} {elapsed / ROUNDS * 1000:8.2f} ms / 次（{COURSES} 门课程）')
+
+        bulk_delete(Achievement, user_id=USER_ID)
+        db.session.commit()
@@ -0,0 +1,58 @@
+"""
+课程表没有变化时的更新开销
+
+以一份 30 门课程的教务系统响应为例，分别测量
+    parse  解析 JSON、整理排序、再序列化后求 md5（原来的做法）
+    raw    直接对原始响应求 blake2b 摘要
+
+    PYTHONPATH=. python benchmarks/class_schedule_no_change.py
+"""
+from hashlib import md5
+from json import dumps
+from time import perf_counter
+
+from nfu.expand.class_schedule import raw_version
+from nfu.expand.nfu import parse_class_schedule
+
+COURSES = 30
+ROUNDS = 2000
+
+
+def make_raw() -> bytes:
+    course_list = []
+    for i in range(COURSES):
+        course_list.append({
+            'name': f'课程{i}',
+            'l3mc': '专业核心课',
+            'pkbdm': f'2020-2021-1-{i:05d}',
+            'kcxf': '3.0',
+            'kbMergeList': [{
+                'teacherList': [{'xm': f'教师{i}'}],
+                'classroomList': [{'jsmc': f'A{i:03d}'}],
+                'xq': i % 7 + 1,
+                'qsj': i % 5 * 2 + 1,
+                'jsj': i % 5 * 2 + 2,
+                'qsz': 1,
+                'jsz': 16
+            } for _ in range(2)]
+        })
+
+    return dumps({'code': 200, 'msg': course_list}).encode('utf-8')
+
+
+def parse(raw: bytes) -> str:
+    return md5(dumps(parse_class_schedule(raw)).encode(encoding='UTF-8')).hexdigest()
+
+
+if __name__ == '__main__':
+    raw = make_raw()
+
+    for name, func in (('parse', parse), ('raw', raw_version)):
+        func(raw)
+
+        start = perf_counter()
+        for _ in range(ROUNDS):
+            func(raw)
+        elapsed = perf_counter() - start
+
+        print(f'{name:<5} {elapsed / ROUNDS * 1e6:8.2f} us / 次（{len(raw)} 字节）')
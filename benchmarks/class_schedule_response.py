@@ -0,0 +1,91 @@
+"""
+课程表响应：loads + jsonify 与 直接返回已序列化的响应 对比
+
+以一份 30 门课程的课程表为例，分别测量
+    cache-old  从 Redis 取出课程表 JSON，loads 后再 jsonify
+    cache-new  Redis 中缓存各个上课时间段的 JSON，直接拼接成响应
+    db-old     数据库命中，逐行 get_dict（每行 loads teacher）后 jsonify
+    db-new     数据库命中，逐行 get_json 拼接
+
+输出每次请求耗时的 p50 / p99，以及 tracemalloc 统计的内存分配峰值
+
+    PYTHONPATH=. python benchmarks/class_schedule_response.py
+"""
+import tracemalloc
+from json import dumps, loads
+from time import perf_counter
+
+from flask import Flask, jsonify
+
+from nfu.common import json_response
+from nfu.expand.class_schedule import to_payload
+from nfu.models import CourseSection
+
+COURSES = 30
+ROUNDS = 5000
+
+
+def make_courses() -> list:
+    return [CourseSection(
+        course_id=f'2020-2021-2-{i:05d}',
+        subdivision_type='专业核心课',
+        course_name=f'课程{i}',
+        credit=3.0,
+        teacher=dumps([f'教师{i}']),
+        classroom=f'A{i:03d}',
+        weekday=i % 7 + 1,
+        start_node=i % 5 * 2 + 1,
+        end_node=i % 5 * 2 + 2,
+        start_week=1,
+        end_week=16
+    ) for i in range(COURSES)]
+
+
+def percentile(timings: list, p: float) -> float:
+    return timings[min(len(timings) - 1, int(len(timings) * p))]
+
+
+def measure(func) -> tuple:
+    func()
+
+    timings = []
+    for _ in range(ROUNDS):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    timings.sort()
+
+    tracemalloc.start()
+    peak = 0
+    for _ in range(100):
+        tracemalloc.reset_peak()
+        func()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    return percentile(timings, 0.5), percentile(timings, 0.99), peak
+
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    courses = make_courses()
+    cache = dumps([course.get_dict() for course in courses])
+    fragments = [course.get_json().encode('utf-8') for course in courses]
+
+    cases = {
+        'cache-old': lambda: jsonify({'code': '1000', 'message': loads(cache), 'version': 'caching'}).get_data(),
+        'cache-new': lambda: json_response(to_payload(fragments, 'caching')).get_data(),
+        'db-old': lambda: jsonify({
+            'code': '1000',
+            'message': [course.get_dict() for course in courses],
+            'version': 'caching'
+        }).get_data(),
+        'db-new': lambda: json_response(
+            to_payload([course.get_json().encode('utf-8') for course in courses], 'caching')
+        ).get_data()
+    }
+
+    with app.app_context():
+        for name, func in cases.items():
+            p50, p99, peak = measure(func)
+            print(f'{name:<10} p50 {p50 * 1e6:8.1f} us  p99 {p99 * 1e6:8.1f} us  分配峰值 {peak / 1024:6.1f} KB')
@@ -0,0 +1,61 @@
+"""
+登录高峰时验证密码的吞吐量
+
+模拟一个 worker 同时收到 LOGINS 个登录请求，分别测量
+    inline  在 worker 内直接 check_password_hash（原来的做法），请求只能一个接一个地算
+    pool    交给 PasswordHasher 的进程池计算，worker 只等待结果
+
+inline 时每次计算期间 worker 无法处理其他请求，表中“最长阻塞”即一次计算的耗时
+
+    PYTHONPATH=. python benchmarks/password_login.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from time import perf_counter
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from nfu.expand.password import PasswordHasher
+
+LOGINS = 200
+PASSWORD = 'correct horse battery staple'
+
+
+class FakeUser:
+    def __init__(self, password: str):
+        self.password = password
+
+
+def inline(user) -> tuple:
+    longest = 0
+
+    start = perf_counter()
+    for _ in range(LOGINS):
+        begin = perf_counter()
+        check_password_hash(user.password, PASSWORD)
+        longest = max(longest, perf_counter() - begin)
+
+    return perf_counter() - start, longest
+
+
+def pool(user, hasher) -> tuple:
+
+    # 预先启动计算进程
+    hasher.verify(user, PASSWORD)
+
+    start = perf_counter()
+    with ThreadPoolExecutor(hasher.queue_limit) as requests:
+        list(requests.map(lambda _: hasher.verify(user, PASSWORD), range(LOGINS)))
+
+    return perf_counter() - start, 0
+
+
+if __name__ == '__main__':
+    hasher = PasswordHasher()
+    hasher.pool_size = cpu_count()
+    hasher.queue_limit = LOGINS
+
+    user = FakeUser(generate_password_hash(PASSWORD, hasher.method))
+
+    for name, (elapsed, longest) in (('inline', inline(user)), ('pool', pool(user, hasher))):
+        print(f'{name:<6} {LOGINS / elapsed:8.1f} 次登录/秒  最长阻塞 {longest * 1000:6.1f} ms')
@@ -0,0 +1,122 @@
+"""
+热点接口 Redis 往返次数对比
+
+模拟每个请求里鉴权装饰器与视图函数对 Redis 的访问：
+    before 每次 new 一个 Redis 客户端（每次都要 TCP 握手 + AUTH）
+    after  使用应用共享的连接池，并把多次读取合并成 MGET / HMGET / pipeline
+
+需要本地运行的 Redis，密码读取环境变量 REDIS_PASSWORD
+
+    python benchmarks/redis_round_trips.py
+"""
+from os import getenv
+from time import perf_counter
+
+from redis import Connection, ConnectionPool, StrictRedis
+
+REQUESTS = 1000
+USER_ID = 181000000
+
+
+class CountingConnection(Connection):
+    """
+    统计建立连接与发送命令的次数
+    """
+    connects = 0
+    round_trips = 0
+
+    def on_connect(self):
+        CountingConnection.connects += 1
+        super().on_connect()
+
+    def send_packed_command(self, command, check_health=True):
+        CountingConnection.round_trips += 1
+        super().send_packed_command(command, check_health)
+
+
+def new_client() -> StrictRedis:
+    return StrictRedis(connection_pool=ConnectionPool(
+        connection_class=CountingConnection,
+        host='localhost',
+        port=6379,
+        password=getenv('REDIS_PASSWORD')
+    ))
+
+
+def class_schedule_get_before():
+    # check_access_token
+    r = new_client()
+    r.get(f'jw-{USER_ID}')
+
+    # /class-schedule/get
+    r = new_client()
+    r.get(f'class-schedule-version-{USER_ID}')
+    r.get(f'class-schedule-{USER_ID}')
+
+
+def class_schedule_get_after(r):
+    r.get(f'jw-{USER_ID}')
+    r.mget(f'class-schedule-version-{USER_ID}', f'class-schedule-{USER_ID}')
+
+
+def token_refresh_before():
+    r = new_client()
+    for field in ('name', 'roomId', 'email', 'dormitory', 'busPower'):
+        r.hget(f'user-{USER_ID}', field)
+
+
+def token_refresh_after(r):
+    r.hmget(f'user-{USER_ID}', 'name', 'roomId', 'email', 'dormitory', 'busPower')
+
+
+def profile_get_before():
+    r = new_client()
+    r.get(f'jw-{USER_ID}')
+
+    r = new_client()
+    for field in ('grade', 'college', 'profession', 'direction'):
+        r.hget(f'profile-{USER_ID}', field)
+
+
+def profile_get_after(r):
+    r.get(f'jw-{USER_ID}')
+    r.hmget(f'profile-{USER_ID}', 'grade', 'college', 'profession', 'direction')
+
+
+def run(name, before, after):
+    shared = new_client()
+
+    result = []
+    for label, func, args in (('before', before, ()), ('after', after, (shared,))):
+        CountingConnection.connects = 0
+        CountingConnection.round_trips = 0
+
+        start = perf_counter()
+        for _ in range(REQUESTS):
+            func(*args)
+        elapsed = perf_counter() - start
+
+        result.append((
+            label,
+            CountingConnection.connects / REQUESTS,
+            CountingConnection.round_trips / REQUESTS,
+            elapsed / REQUESTS * 1e6
+        ))
+
+    print(name)
+    for label, connects, round_trips, cost in result:
+        print(f'    {label:<6} 连接/请求 {connects:5.2f}  往返/请求 {round_trips:5.2f}  耗时 {cost:8.1f} us')
+
+
+if __name__ == '__main__':
+    with new_client().pipeline() as pipe:
+        pipe.set(f'jw-{USER_ID}', 'password')
+        pipe.set(f'class-schedule-version-{USER_ID}', 'version')
+        pipe.set(f'class-schedule-{USER_ID}', '[]')
+        pipe.hset(f'user-{USER_ID}', mapping={'name': 'n', 'roomId': 1, 'email': 'e', 'dormitory': 'd', 'busPower': 0})
+        pipe.hset(f'profile-{USER_ID}', mapping={'grade': 2018, 'college': 'c', 'profession': 'p', 'direction': 'd'})
+        pipe.execute()
+
+    run('/class-schedule/get', class_schedule_get_before, class_schedule_get_after)
+    run('/oauth/token/refresh', token_refresh_before, token_refresh_after)
+    run('/user/profile', profile_get_before, profile_get_after)
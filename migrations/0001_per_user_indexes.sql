@@ -0,0 +1,21 @@
+-- 按实际查询条件补充联合索引
+
+-- /achievement/get、成绩同步：where user_id = ? [and school_year = ? and semester = ?]
+alter table achievement
+    add index user_semester (user_id, school_year, semester);
+
+-- /class-schedule/get、课表同步：where user_id = ? and school_year = ? and semester = ?
+alter table class_schedule
+    add index user_semester (user_id, school_year, semester);
+
+-- /electric/get、/electric/analyse：where room_id = ? order by date desc，覆盖 value 避免回表
+alter table electric
+    add index room_date (room_id, date, value),
+    drop index room_id;
+
+-- 刷票下单防重复：where user_id = ? and ticket_date = ? and bus_ids = ?
+alter table ticket_order
+    add index user_ticket (user_id, ticket_date, bus_ids);
+
+alter table ticket_order
+    drop index user_id;
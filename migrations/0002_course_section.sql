@@ -0,0 +1,55 @@
+-- 同一教学班的上课时间段由选课的同学共用，class_schedule 只保留选课关系
+
+create table course_section
+(
+    id               bigint unsigned not null primary key auto_increment,
+    school_year      int             not null,
+    semester         tinyint         not null,
+    course_id        varchar(50)     not null,
+    weekday          tinyint         not null,
+    start_node       tinyint         not null,
+    end_node         tinyint         not null,
+    start_week       tinyint         not null,
+    end_week         tinyint         not null,
+    subdivision_type varchar(20)     not null,
+    course_name      varchar(50)     not null,
+    credit           float           not null,
+    teacher          json            not null,
+    classroom        char(25)        not null,
+    unique index section (school_year, semester, course_id, weekday, start_node, end_node, start_week, end_week)
+);
+
+-- 同一时间段以最近同步的数据为准
+insert into course_section (school_year, semester, course_id, weekday, start_node, end_node, start_week, end_week,
+                            subdivision_type, course_name, credit, teacher, classroom)
+select school_year, semester, course_id, weekday, start_node, end_node, start_week, end_week,
+       subdivision_type, course_name, credit, teacher, classroom
+from class_schedule
+order by id desc
+on duplicate key update id = id;
+
+alter table class_schedule
+    add column section_id bigint unsigned null after semester;
+
+update class_schedule c
+    join course_section s
+    on s.school_year = c.school_year and s.semester = c.semester and s.course_id = c.course_id and
+       s.weekday = c.weekday and s.start_node = c.start_node and s.end_node = c.end_node and
+       s.start_week = c.start_week and s.end_week = c.end_week
+set c.section_id = s.id;
+
+alter table class_schedule
+    drop index course_id,
+    drop column subdivision_type,
+    drop column course_name,
+    drop column course_id,
+    drop column credit,
+    drop column teacher,
+    drop column classroom,
+    drop column weekday,
+    drop column start_node,
+    drop column end_node,
+    drop column start_week,
+    drop column end_week,
+    modify section_id bigint unsigned not null,
+    add foreign key (section_id) references course_section (id) on delete cascade on update cascade;
@@ -2,6 +2,17 @@ create database nfu;
 
 use nfu;
 
+create table schema_version
+(
+    version    int unsigned not null primary key,
+    name       varchar(100) not null,
+    applied_at datetime     not null
+);
+
+insert into schema_version (version, name, applied_at)
+values (1, '0001_per_user_indexes', now()),
+       (2, '0002_course_section', now());
+
 create table user
 (
     id       int unsigned not null primary key,
@@ -36,7 +47,7 @@ create table electric
     room_id int  not null,
     value   float,
     date    date not null,
-    index room_id (room_id)
+    index room_date (room_id, date, value)
 );
 
 create table total_achievements
@@ -68,28 +79,39 @@ create table achievement
     peacetime_achievements       float        not null,
     resit_exam_achievement_point float        null,
     index course_id (course_id),
+    index user_semester (user_id, school_year, semester),
     foreign key (user_id) references user (id) on delete cascade on update cascade
 );
 
-create table class_schedule
+create table course_section
 (
     id               bigint unsigned not null primary key auto_increment,
-    user_id          int unsigned    not null,
     school_year      int             not null,
     semester         tinyint         not null,
-    subdivision_type varchar(20)     not null,
-    course_name      varchar(50)     not null,
     course_id        varchar(50)     not null,
-    credit           float           not null,
-    teacher          json            not null,
-    classroom        char(25)        not null,
     weekday          tinyint         not null,
     start_node       tinyint         not null,
     end_node         tinyint         not null,
     start_week       tinyint         not null,
     end_week         tinyint         not null,
-    index course_id (course_id),
-    foreign key (user_id) references user (id) on delete cascade on update cascade
+    subdivision_type varchar(20)     not null,
+    course_name      varchar(50)     not null,
+    credit           float           not null,
+    teacher          json            not null,
+    classroom        char(25)        not null,
+    unique index section (school_year, semester, course_id, weekday, start_node, end_node, start_week, end_week)
+);
+
+create table class_schedule
+(
+    id          bigint unsigned not null primary key auto_increment,
+    user_id     int unsigned    not null,
+    school_year int             not null,
+    semester    tinyint         not null,
+    section_id  bigint unsigned not null,
+    index user_semester (user_id, school_year, semester),
+    foreign key (user_id) references user (id) on delete cascade on update cascade,
+    foreign key (section_id) references course_section (id) on delete cascade on update cascade
 );
 
 create table ticket_order
@@ -104,7 +126,7 @@ create table ticket_order
     order_time    datetime     not null,
     order_state   tinyint      not null,
     ticket_date   date         not null,
-    index user_id (user_id),
+    index user_ticket (user_id, ticket_date, bus_ids),
     unique index order_id (order_id),
     foreign key (user_id) references user (id) on delete cascade on update cascade
 );
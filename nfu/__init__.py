@@ -5,10 +5,14 @@
 :license: MIT, see LICENSE for more details.
 """
 import os
+from datetime import datetime
+from socket import gethostname
 
+import click
 import sentry_sdk
 from flask import Flask, jsonify
 from sentry_sdk.integrations.flask import FlaskIntegration
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from nfu.api_bp.achievement import achievement_bp
 from nfu.api_bp.class_schedule import class_schedule_bp
@@ -17,7 +21,17 @@ from nfu.api_bp.oauth import oauth_bp
 from nfu.api_bp.school_bus import school_bus_bp
 from nfu.api_bp.user import user_bp
 from nfu.api_bp.validate import validate_bp
-from nfu.extensions import db, mail
+from nfu.expand.free_room import rebuild_changed, rebuild_occupancy
+from nfu.expand.jw_client import jw_client
+from nfu.expand.metrics import get_metrics, reset_metrics
+from nfu.expand.migrate import explain_hot_queries, upgrade
+from nfu.expand.password import password_hasher
+from nfu.expand.rank import rebuild_rank
+from nfu.expand.reference import reference
+from nfu.expand.school_config import get_config, get_next_config, set_config
+from nfu.expand.sign_up import work
+from nfu.expand.warmup import warm_up
+from nfu.extensions import db, mail, redis
 
 sentry_sdk.init(
     dsn=os.getenv("SENRTY_DSN"),
@@ -33,6 +47,10 @@ def create_app(config_name=None) -> Flask:
     app = Flask('nfu')
     app.config.from_pyfile('settings.py')
 
+    # 部署在反向代理之后时，按代理传来的地址识别客户端，限流才能按 IP 区分
+    if app.config['PROXY_COUNT']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_COUNT'])
+
     # 本地开发由 flask-cors 提供 CORS
     if config_name is None:
         from flask_cors import CORS
@@ -41,6 +59,7 @@ def create_app(config_name=None) -> Flask:
     register_blueprints(app)
     register_extensions(app)
     register_errors(app)
+    register_commands(app)
     return app
 
 
@@ -67,6 +86,10 @@ def register_extensions(app) -> None:
     """
     db.init_app(app)
     mail.init_app(app)
+    redis.init_app(app)
+    jw_client.init_app(app)
+    password_hasher.init_app(app)
+    reference.init_app(app)
 
 
 def register_errors(app) -> None:
@@ -87,3 +110,146 @@ def register_errors(app) -> None:
     @app.errorhandler(500)
     def internal_server_error(e):
         return jsonify({'message': '500 错误 – 服务器内部错误'}), 500
+
+
+def register_commands(app) -> None:
+    """
+    注册命令
+    :param app:
+    :return:
+    """
+
+    @app.cli.command('db-upgrade')
+    def db_upgrade():
+        """
+        执行数据库迁移
+        """
+        applied = upgrade()
+        for name in applied:
+            click.echo(f'已执行 {name}')
+
+        click.echo(f'数据库已是最新版本，本次执行 {len(applied)} 个迁移')
+
+    @app.cli.command('db-explain')
+    def db_explain():
+        """
+        检查热点查询是否走索引，存在全表扫描时以非零状态退出
+        """
+        problems = explain_hot_queries()
+        for name, table, problem in problems:
+            click.echo(f'{name} {table}: {problem}', err=True)
+
+        if problems:
+            raise SystemExit(1)
+
+        click.echo('所有热点查询均命中索引')
+
+    @app.cli.command('metrics')
+    @click.option('--prefix', default='', help='只显示以此开头的计数器，如 session-')
+    @click.option('--reset', is_flag=True, help='显示后清零')
+    def metrics(prefix, reset):
+        """
+        查看运行计数器
+        """
+        counters = get_metrics(prefix)
+        for name in sorted(counters):
+            click.echo(f'{name}: {counters[name]}')
+
+        hit, miss = counters.get('session-hit', 0), counters.get('session-miss', 0)
+        if hit + miss:
+            click.echo(f'刷新令牌缓存命中率：{hit / (hit + miss):.2%}')
+
+        if reset:
+            reset_metrics(prefix)
+
+    @app.cli.command('rank-rebuild')
+    def rank_rebuild():
+        """
+        根据数据库重建绩点排名
+        """
+        click.echo(f'已写入 {rebuild_rank()} 位同学的排名')
+
+    @app.cli.command('rooms-rebuild')
+    @click.option('--school-year', type=int, required=True, help='学年')
+    @click.option('--semester', type=int, required=True, help='学期')
+    @click.option('--changed', is_flag=True, help='只重建有变化的教室，适合定时执行')
+    def rooms_rebuild(school_year, semester, changed):
+        """
+        重建教室占用位图
+        """
+        if changed:
+            count = rebuild_changed(school_year, semester)
+        else:
+            count = rebuild_occupancy(school_year, semester)
+
+        click.echo(f'已重建 {count} 间教室的占用情况')
+
+    @app.cli.command('school-config')
+    @click.option('--school-year', type=int, help='学年')
+    @click.option('--semester', type=int, help='学期')
+    @click.option('--opens', type=click.DateTime(['%Y-%m-%d']), help='开学日期')
+    @click.option('--switch', type=click.DateTime(['%Y-%m-%d %H:%M', '%Y-%m-%d']), help='切换时间，不填则立即生效')
+    def school_config(school_year, semester, opens, switch):
+        """
+        查看或修改学年配置，不带参数时只查看
+        """
+        if school_year is not None:
+            if semester is None or opens is None:
+                raise click.UsageError('修改配置需要同时提供 --school-year、--semester、--opens')
+
+            set_config(
+                school_year,
+                semester,
+                int(opens.timestamp() * 1000),
+                None if switch is None else int(switch.timestamp() * 1000)
+            )
+
+        click.echo(f'当前配置：{get_config()}')
+
+        config_next = get_next_config()
+        if config_next:
+            switch_time = datetime.fromtimestamp(config_next.pop('switchTimestamp') / 1000)
+            click.echo(f'{switch_time:%Y-%m-%d %H:%M} 切换为：{config_next}')
+
+    @app.cli.command('semester-warmup')
+    @click.option('--school-year', type=int, help='学年，默认为预先设置的下学期')
+    @click.option('--semester', type=int, help='学期，默认为预先设置的下学期')
+    @click.option('--batch-size', type=click.IntRange(min=1), default=100, help='每批读取的学生数')
+    @click.option('--rate', type=float, help='每秒最多处理的学生数，默认为 SEMESTER_WARMUP_RATE')
+    @click.option('--restart', is_flag=True, help='忽略之前的进度，从头开始')
+    def semester_warmup(school_year, semester, batch_size, rate, restart):
+        """
+        换学期前预先获取所有学生新学期的课程表，可中断后继续
+        """
+        if rate is None:
+            rate = app.config['SEMESTER_WARMUP_RATE']
+
+        if rate <= 0:
+            raise click.BadParameter('必须大于 0', param_hint='--rate 或 SEMESTER_WARMUP_RATE')
+
+        if school_year is None or semester is None:
+            config_next = get_next_config()
+            if not config_next:
+                raise click.UsageError('没有预先设置下学期的配置，请指定 --school-year 与 --semester')
+
+            school_year, semester = config_next['schoolYear'], config_next['semester']
+
+        for progress in warm_up(school_year, semester, batch_size, rate, restart):
+            click.echo(
+                f"{school_year}-{semester} 已处理 {progress['done'] + progress['empty'] + progress['failed']}"
+                f"/{progress['total']}，课表为空 {progress['empty']}，失败 {progress['failed']}，"
+                f"当前学号 {progress['cursor']}"
+            )
+
+        click.echo(f'{school_year}-{semester} 已全部处理完毕')
+
+    @app.cli.command('sign-up-worker')
+    @click.option('--name', default=gethostname, help='任务进程名，同时运行多个时各不相同，默认为主机名')
+    def sign_up_worker(name):
+        """
+        处理注册任务：校对教务系统账号并发送激活邮件，需要常驻运行，可以同时运行多个
+        """
+        click.echo(f'{name} 开始处理注册任务')
+
+        for job_id, status in work(name):
+            click.echo(f'{job_id} {status}')
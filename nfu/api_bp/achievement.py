@@ -1,9 +1,12 @@
 from flask import Blueprint, g, jsonify
 
-from nfu.common import check_access_token, get_school_config
-from nfu.expand.achievement import db_get, db_init, db_update
-from nfu.expand.total_achievement import db_init_total, db_update_total
-from nfu.models import Achievement, TotalAchievements
+from nfu.common import check_access_token, get_school_config, is_not_modified, not_modified, rate_limit, set_etag
+from nfu.expand.achievement import db_update, get_achievement, get_version
+from nfu.expand.achievement_stats import get_achievement_stats
+from nfu.expand.rank import get_rank
+from nfu.expand.sync import coalesce
+from nfu.expand.total_achievement import db_update_total, get_total, get_total_version
+from nfu.extensions import redis
 from nfu.nfu_error import NFUError
 
 achievement_bp = Blueprint('achievement', __name__)
@@ -15,29 +18,31 @@ achievement_bp = Blueprint('achievement', __name__)
 def get():
     """
     获取成绩单
-    :return:
-    """
 
-    achievement_db = Achievement.query.filter_by(user_id=g.user.id).all()
+    支持 If-None-Match，版本号由各学期的内容摘要合成，
+    客户端持有的已是当前版本时直接返回 304，不查询数据库
 
-    # 数据库存在成绩数据
-    if achievement_db:
-        return jsonify({
-            'code': '1000',
-            'message': db_get(achievement_db)
-        })
+    :return:
+    """
+    version = get_version(g.user.id)
+    if is_not_modified(version):
+        return not_modified(version)
 
     try:
-        return jsonify({
-            'code': '1000',
-            'message': db_init(g.user.id, g.user.jw_pwd, g.school_config['schoolYear'], g.school_config['semester'])
-        })
+        message = get_achievement(g.user, g.school_config['schoolYear'], g.school_config['semester'])
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
 
+    # 第一次获取时，版本号在加载后才写入
+    if version is None:
+        version = get_version(g.user.id)
+
+    return set_etag(jsonify({'code': '1000', 'message': message}), version)
+
 
 @achievement_bp.route('/update')
 @check_access_token
+@rate_limit('update')
 @get_school_config
 def update():
     """
@@ -45,42 +50,86 @@ def update():
     :return:
     """
     try:
-        return jsonify({
-            'code': '1000',
-            'message': db_update(g.user.id, g.user.jw_pwd, g.school_config['schoolYear'], g.school_config['semester'])
-        })
+        message = coalesce('achievement', g.user.id, lambda: db_update(
+            g.user.id,
+            g.user.jw_pwd,
+            g.school_config['schoolYear'],
+            g.school_config['semester']
+        ))
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
 
+    return set_etag(jsonify({'code': '1000', 'message': message}), get_version(g.user.id))
+
 
 @achievement_bp.route('/total')
 @check_access_token
-def get_total():
+def get_total_api():
     """
     获取总体成绩信息
-    :return:
-    """
 
-    achievement_db = TotalAchievements.query.get(g.user.id)
+    支持 If-None-Match，客户端持有的已是当前版本时直接返回 304，不查询数据库
 
-    # 数据库存在数据
-    if achievement_db:
-        return jsonify({'code': '1000', 'message': achievement_db.get_dict()})
+    :return:
+    """
+    version = redis.get(f'total-achievement-version-{g.user.id}')
+    if version is not None:
+        version = version.decode('utf-8')
+        if is_not_modified(version):
+            return not_modified(version)
 
     try:
-        return jsonify({'code': '1000', 'message': db_init_total(g.user.id, g.user.jw_pwd)})
+        message = get_total(g.user)
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
 
+    # 旧数据没有记录版本号，补上
+    if version is None:
+        version = get_total_version(message)
+        redis.set(f'total-achievement-version-{g.user.id}', version)
+
+    return set_etag(jsonify({'code': '1000', 'message': message}), version)
+
 
 @achievement_bp.route('/update/total')
 @check_access_token
+@rate_limit('update')
 def update_total():
     """
     更新总体成绩信息
     :return:
     """
     try:
-        return jsonify({'code': '1000', 'message': db_update_total(g.user.id, g.user.jw_pwd)})
+        message = coalesce('total-achievement', g.user.id, lambda: db_update_total(g.user.id, g.user.jw_pwd))
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
+
+    return set_etag(jsonify({'code': '1000', 'message': message}), get_total_version(message))
+
+
+@achievement_bp.route('/stats')
+@check_access_token
+def get_stats():
+    """
+    根据已同步的成绩单，计算每学期及累计的学分与绩点
+    :return:
+    """
+    stats = get_achievement_stats(g.user.id)
+
+    if not stats['semesters']:
+        return jsonify({'code': '2000', 'message': '请先获取成绩单'})
+
+    return jsonify({'code': '1000', 'message': stats})
+
+
+@achievement_bp.route('/rank')
+@check_access_token
+def rank():
+    """
+    获取平均绩点在同年级同专业、同年级同学院中的排名
+    :return:
+    """
+    try:
+        return jsonify({'code': '1000', 'message': get_rank(g.user.id)})
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
@@ -1,12 +1,12 @@
-from json import dumps, loads
-from os import getenv
-
-from flask import Blueprint, g, jsonify
-from redis import Redis
-
-from nfu.common import check_access_token, get_school_config
-from nfu.expand.class_schedule import db_init, db_update
-from nfu.models import ClassSchedule
+from flask import Blueprint, g, jsonify, request
+
+from nfu.common import check_access_token, get_school_config, is_not_modified, json_response, not_modified, rate_limit, \
+    set_etag
+from nfu.expand.class_schedule import db_update, get_payload, get_section_json, get_sections, get_version, \
+    to_payload
+from nfu.expand.free_room import get_free_rooms
+from nfu.expand.schedule_index import MAX_WEEK, NODES, get_day_sections, get_index, get_week_now, get_week_sections
+from nfu.expand.sync import coalesce
 from nfu.nfu_error import NFUError
 
 class_schedule_bp = Blueprint('class_schedule', __name__)
@@ -18,69 +18,31 @@ class_schedule_bp = Blueprint('class_schedule', __name__)
 def get():
     """
     获取课程表数据
+
+    支持 If-None-Match，客户端持有的已是当前版本时直接返回 304，不读取课程表；
+    用各个上课时间段已序列化的 JSON 直接拼接
+
     :return:
     """
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    class_schedule_version = r.get(f'class-schedule-version-{g.user.id}')
+    try:
+        section_ids, class_schedule_version = get_sections(
+            g.user,
+            g.school_config['schoolYear'],
+            g.school_config['semester']
+        )
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
-    if class_schedule_version is None:
+    etag = __etag(class_schedule_version)
+    if is_not_modified(etag):
+        return not_modified(etag)
 
-        # Redis里面没有缓存则往mysql读取数据
-        class_schedule = []
-        class_schedule_db = ClassSchedule.query.filter_by(
-            user_id=g.user.id,
-            school_year=g.school_config['schoolYear'],
-            semester=g.school_config['semester']
-        ).all()
-
-        if class_schedule_db:
-
-            # mysql中有缓存课程表
-            for course in class_schedule_db:
-                class_schedule.append(course.get_dict())
-
-            r.set(f'class-schedule-version-{g.user.id}', 'caching')
-            r.set(f'class-schedule-{g.user.id}', dumps(class_schedule))
-
-            return jsonify({
-                'code': '1000',
-                'message': class_schedule,
-                'version': 'caching'
-            })
-
-        else:
-
-            # mysql里面也没有缓存，只能向教务系统获取
-            try:
-                message = db_init(
-                    g.user.id,
-                    g.user.jw_pwd,
-                    g.school_config['schoolYear'],
-                    g.school_config['semester'],
-                    r
-                )
-            except NFUError as err:
-                return jsonify({'code': err.code, 'message': err.message})
-
-            return jsonify({
-                'code': '1000',
-                'message': message,
-                'version': r.get(f'class-schedule-version-{g.user.id}').decode('utf-8')
-            })
-
-    else:
-
-        # Redis有缓存则直接获取Redis的数据
-        class_schedule_version = class_schedule_version.decode('utf-8')
-        return jsonify({
-            'code': '1000',
-            'message': loads(r.get(f'class-schedule-{g.user.id}').decode('utf-8')),
-            'version': class_schedule_version
-        })
+    return set_etag(json_response(get_payload(section_ids, class_schedule_version)), etag)
 
 
 @class_schedule_bp.route('/update')
 @check_access_token
+@rate_limit('update')
 @get_school_config
 def update():
     """
@@ -88,38 +50,156 @@ def update():
     :return:
     """
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
+    school_year, semester = g.school_config['schoolYear'], g.school_config['semester']
+
+    def sync():
+        payload, class_schedule_version = db_update(g.user.id, g.user.jw_pwd, school_year, semester)
+        return payload.decode('utf-8'), class_schedule_version
+
+    try:
+        payload, class_schedule_version = coalesce(f'class-schedule-{school_year}-{semester}', g.user.id, sync)
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
+
+    return set_etag(json_response(payload.encode('utf-8')), __etag(class_schedule_version))
+
+
+@class_schedule_bp.route('/today')
+@check_access_token
+@get_school_config
+def today():
+    """
+    获取今天的课程，按开始节次排序
+
+    可选参数 node 为当前节次，传入时 current 为正在上的课、next 为下一节课在 message 中的下标
+
+    :return:
+    """
+    node = request.args.get('node', type=int)
+    if node is not None and not 1 <= node <= NODES:
+        return jsonify({'code': '2000', 'message': '节次不正确'})
+
+    try:
+        section_ids, class_schedule_version = get_sections(
+            g.user,
+            g.school_config['schoolYear'],
+            g.school_config['semester']
+        )
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
+
+    week, weekday = get_week_now(g.school_config['schoolOpensTimestamp'])
+    index = get_index(
+        g.user.id,
+        g.school_config['schoolYear'],
+        g.school_config['semester'],
+        section_ids,
+        class_schedule_version
+    )
+    day = get_day_sections(index, week, weekday, node)
+
+    return json_response(to_payload(
+        get_section_json(day['sections']),
+        class_schedule_version,
+        week=week,
+        weekday=weekday,
+        current=day['current'],
+        next=day['next']
+    ))
+
+
+@class_schedule_bp.route('/week/<int:week>')
+@check_access_token
+@get_school_config
+def week_schedule(week):
+    """
+    获取第 week 周的课程
+    :param week:
+    :return:
+    """
+    if not 1 <= week <= MAX_WEEK:
+        return jsonify({'code': '2000', 'message': '周次不正确'})
 
     try:
-        return jsonify({
-            'code': '1000',
-            'message': db_update(
-                g.user.id,
-                g.user.jw_pwd,
-                g.school_config['schoolYear'],
-                g.school_config['semester'],
-                r
-            ),
-            'version': r.get(f'class-schedule-version-{g.user.id}').decode('utf-8')
-        })
+        section_ids, class_schedule_version = get_sections(
+            g.user,
+            g.school_config['schoolYear'],
+            g.school_config['semester']
+        )
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
 
+    etag = f'{__etag(class_schedule_version)}-{week}'
+    if is_not_modified(etag):
+        return not_modified(etag)
+
+    index = get_index(
+        g.user.id,
+        g.school_config['schoolYear'],
+        g.school_config['semester'],
+        section_ids,
+        class_schedule_version
+    )
+
+    return set_etag(json_response(to_payload(
+        get_section_json(get_week_sections(index, week)),
+        class_schedule_version,
+        week=week
+    )), etag)
+
+
+@class_schedule_bp.route('/free-rooms')
+@check_access_token
+@get_school_config
+def free_rooms():
+    """
+    查询空闲教室
+
+    - 参数
+        - week 周次，默认本周
+        - weekday 星期，默认今天
+        - nodes 节次，如 3-4 或 1,2,5
+
+    只统计已同步过的课程表中出现过的教室，课程表的变化在定时执行 rooms-rebuild --changed 后生效
+
+    :return:
+    """
+    week_now, weekday_now = get_week_now(g.school_config['schoolOpensTimestamp'])
+    week = request.args.get('week', week_now, type=int)
+    weekday = request.args.get('weekday', weekday_now, type=int)
+
+    try:
+        nodes = __parse_nodes(request.args.get('nodes', ''))
+    except ValueError:
+        nodes = None
+
+    if not nodes or not 1 <= week <= MAX_WEEK or not 1 <= weekday <= 7:
+        return jsonify({'code': '2000', 'message': '查询的时间不正确'})
+
+    return jsonify({'code': '1000', 'message': get_free_rooms(
+        g.school_config['schoolYear'],
+        g.school_config['semester'],
+        week,
+        weekday,
+        nodes
+    )})
+
 
 @class_schedule_bp.route('/version')
 @check_access_token
+@get_school_config
 def version():
     """
     获取缓存的版本号
+
+    新版客户端请直接使用 /get 的 If-None-Match，可以省去这一次请求
+
     :return:
     """
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    class_schedule_version = r.get(f'class-schedule-version-{g.user.id}')
+    class_schedule_version = get_version(g.user.id, g.school_config['schoolYear'], g.school_config['semester'])
 
     if class_schedule_version is None:
         class_schedule_version = 'update'
-    else:
-        class_schedule_version = class_schedule_version.decode('utf-8')
 
     return jsonify({
         'code': '1000',
@@ -135,3 +215,35 @@ def school_config():
     获取学年配置
     """
     return jsonify({'code': '1000', 'message': g.school_config})
+
+
+def __etag(class_schedule_version: str) -> str:
+    """
+    课程表的 ETag，带上学年学期，换学期后旧的 ETag 自然失效
+    :param class_schedule_version:
+    :return:
+    """
+    return f"{g.school_config['schoolYear']}-{g.school_config['semester']}-{class_schedule_version}"
+
+
+def __parse_nodes(nodes: str) -> list:
+    """
+    解析节次参数，支持 3-4 与 1,2,5 两种写法
+    :param nodes:
+    :return:
+    """
+    result = set()
+    for item in nodes.split(','):
+        if not item.strip():
+            continue
+
+        start, _, end = item.partition('-')
+        start = int(start)
+        end = int(end) if end else start
+
+        if not 1 <= start <= end <= NODES:
+            raise ValueError(item)
+
+        result.update(range(start, end + 1))
+
+    return sorted(result)
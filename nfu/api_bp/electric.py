@@ -4,8 +4,9 @@ from flask import Blueprint, g, jsonify, request, send_file
 
 from nfu.common import check_access_token
 from nfu.expand.electric import ElectricPay, get_electric_log
+from nfu.expand.reference import reference
 from nfu.expand_bus.ticket import get_qrcode
-from nfu.models import Dormitory, Electric
+from nfu.models import Electric
 from nfu.nfu_error import NFUError
 
 electric_bp = Blueprint('electric', __name__)
@@ -79,18 +80,23 @@ def create_order():
     try:
         data = loads(request.get_data().decode('utf-8'))
         amount = data['amount']
-        dormitory = Dormitory.query.get(g.user.room_id)
     except ValueError:
         return jsonify({'code': '2000', 'message': '服务器内部错误'})
 
+    dormitory = reference.get_dormitory(g.user.room_id)
+    if dormitory is None:
+        return jsonify({'code': '2000', 'message': '宿舍不存在，请重新设置宿舍'})
+
+    building, floor, room = dormitory
+
     order = ElectricPay(
         amount=amount,
         user_id=g.user.id,
         name=g.user.name,
         room_id=g.user.room_id,
-        building=dormitory.building,
-        floor=dormitory.floor,
-        room=dormitory.room
+        building=building,
+        floor=floor,
+        room=room
     )
 
     try:
@@ -4,15 +4,17 @@ from os import getenv
 from random import sample
 from string import ascii_letters, digits
 
-from flask import Blueprint, jsonify, redirect, render_template, request
-from redis import Redis
+from flask import Blueprint, current_app, jsonify, redirect, render_template, request
 from requests import get
 
-from nfu.common import get_token
+from nfu.common import get_token, is_not_modified, json_response, not_modified, rate_limit, set_etag
 from nfu.expand.email import send_validate_email
-from nfu.expand.nfu import get_student_name
-from nfu.expand.token import create_access_token, generate_token, validate_token, write_access_token_redis_cache
-from nfu.extensions import db
+from nfu.expand.password import password_hasher
+from nfu.expand.reference import reference
+from nfu.expand.session import load_session, write_session
+from nfu.expand.sign_up import enqueue, get_job
+from nfu.expand.token import create_access_token, generate_token, validate_token
+from nfu.extensions import db, redis
 from nfu.models import User
 from nfu.nfu_error import NFUError
 
@@ -20,6 +22,7 @@ oauth_bp = Blueprint('oauth', __name__)
 
 
 @oauth_bp.route('/token', methods=['POST'])
+@rate_limit('login')
 def get_token_bp() -> jsonify:
     """
     登陆接口，获取令牌
@@ -34,21 +37,23 @@ def get_token_bp() -> jsonify:
 
     # 首先验证账号是否存在
     user = User.query.get(user_id)
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
 
     if user is None:  # 当MySql为空时
 
         # 查看缓存是否有已注册的信息
-        if r.hget(f"sign-up-{user_id}", 'name') is None:
+        if redis.hget(f"sign-up-{user_id}", 'name') is None:
             return jsonify({'code': '0001', 'message': '南苑聚合账号不存在'})
 
         else:
             return jsonify({'code': '0002', 'message': '账号暂未激活'})
 
-    if not user.validate_password(data['password']):
-        return jsonify({'code': '0003', 'message': '密码错误'})
+    try:
+        if not password_hasher.verify(user, data['password']):
+            return jsonify({'code': '0003', 'message': '密码错误'})
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
-    dormitory, bus_power = write_access_token_redis_cache(r, user)
+    dormitory, bus_power = write_session(user)
 
     return jsonify(create_access_token(user, dormitory, bus_power))
 
@@ -66,24 +71,16 @@ def refresh_token() -> jsonify:
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-
-    try:  # 从 Redis 读取信息
-        name = r.hget(f"user-{validate['id']}", 'name').decode('utf-8')
-        room_id = int(r.hget(f"user-{validate['id']}", 'roomId').decode('utf-8'))
-        email = r.hget(f"user-{validate['id']}", 'email').decode('utf-8')
-        dormitory = r.hget(f"user-{validate['id']}", 'dormitory').decode('utf-8')
-        bus_power = int(r.hget(f"user-{validate['id']}", 'busPower'))
-    except AttributeError:
-        user = User.query.get(validate['id'])
-        dormitory, bus_power = write_access_token_redis_cache(r, user)
-    else:
-        user = User(id=validate['id'], name=name, room_id=room_id, email=email)
+    try:
+        user, dormitory, bus_power = load_session(validate['id'])
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
     return jsonify(create_access_token(user, dormitory, bus_power))
 
 
 @oauth_bp.route('/sign-up', methods=['POST'])
+@rate_limit('sign-up')
 def sign_up() -> jsonify:
     """
     注册接口
@@ -93,11 +90,14 @@ def sign_up() -> jsonify:
         data = loads(request.get_data().decode('utf-8'))
         user_id = int(data['userId'])
         password = data['password']
-        room_id = data['roomId']
+        room_id = int(data['roomId'])
         email = data['email']
     except (TypeError, ValueError):
         return jsonify({'code': '2000', 'message': '服务器内部错误'})
 
+    if reference.get_dormitory(room_id) is None:
+        return jsonify({'code': '2000', 'message': '宿舍不存在'})
+
     # 防一波教务系统bug...
     if password is None or password == '':
         return jsonify({'code': '2000', 'message': '密码不能为空'})
@@ -106,28 +106,45 @@ def sign_up() -> jsonify:
     if user is not None:
         return jsonify({'code': '2000', 'message': '该账号已存在'})
 
-    # 如果正确获得学生姓名，默认代表该用户拥有该账号合法性
-    try:
-        name = get_student_name(user_id, password)
-    except NFUError as err:
-        return jsonify({'code': err.code, 'message': err.message})
+    # 校对教务系统账号与发送邮件交给后台任务，不在请求中等待教务系统
+    return jsonify({'code': '1000', 'message': {'jobId': enqueue(user_id, password, room_id, email)}})
+
 
-    token = generate_token({'id': user_id}, token_type='EMAIL_TOKEN')
-    send_validate_email(email, name, user_id, token)
+@oauth_bp.route('/sign-up/<string:job_id>')
+def sign_up_status(job_id: str) -> jsonify:
+    """
+    查询注册任务的状态
 
-    # 把帐号资料写入缓存
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    r.hmset(f"sign-up-{user_id}", {
-        'name': name,
-        'password': password,
-        'roomId': room_id,
-        'email': email
-    })
+    带上 wait 参数时，任务未完成则最多等待 wait 秒再返回
 
-    # 设置缓存一小时过期
-    r.expire(user_id, 3600)
+    :param job_id:
+    :return: json
+    """
+    wait = min(max(request.args.get('wait', 0, type=float), 0), current_app.config['SIGN_UP_WAIT_MAX'])
 
-    return jsonify({'code': '1000', 'message': '激活邮件已发送至您的邮箱，请查看'})
+    job = get_job(job_id, wait)
+    if job is None:
+        return jsonify({'code': '2000', 'message': '注册任务不存在或已过期，请重新注册'})
+
+    return jsonify({'code': '1000', 'message': job})
+
+
+@oauth_bp.route('/dormitory')
+def dormitory_tree() -> jsonify:
+    """
+    注册时选宿舍用的 楼栋 -> 楼层 -> 房间
+    :return: json
+    """
+    payload, etag = reference.get_dormitory_tree()
+
+    if is_not_modified(etag):
+        response = not_modified(etag)
+    else:
+        response = set_etag(json_response(payload), etag)
+
+    # 所有人看到的都一样，允许 CDN 与浏览器缓存一天，过期后凭 ETag 重新验证
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 
 @oauth_bp.route('/nfuca')
@@ -159,11 +176,9 @@ def nfuca() -> jsonify:
     except KeyError:
         return render_template('html/err.html', err='提交信息不合法')
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-
     user = User.query.get(nfuca_data["data"]["no"])
     if user is None:  # 当MySql为空时
-        r.set(oauth_id, response.text, ex=3600)
+        redis.set(oauth_id, response.text, ex=3600)
         return redirect(f"{getenv('FRONT_END_URL')}/oauth/nfuca/sign-up?sign={oauth_id}")
 
     if user.open_id is None:
@@ -171,7 +186,7 @@ def nfuca() -> jsonify:
         db.session.add(user)
         db.session.commit()
 
-    r.set(oauth_id, nfuca_data["data"]["no"], ex=30)
+    redis.set(oauth_id, nfuca_data["data"]["no"], ex=30)
     return redirect(f"{getenv('FRONT_END_URL')}/oauth/nfuca?sign={oauth_id}")
 
 
@@ -186,24 +201,19 @@ def nfuca_login() -> jsonify:
     except ValueError:
         return jsonify({'code': '2000', 'message': '服务器内部错误'})
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    user_id = r.get(sign).decode('utf-8')
-    r.delete(sign)
+    # 读取并删除签名，一次往返
+    pipe = redis.pipeline()
+    pipe.get(sign)
+    pipe.delete(sign)
+    user_id, _ = pipe.execute()
 
     if user_id is None:
         return jsonify({'code': '2000', 'message': '签名已过期'})
 
-    try:  # 从 Redis 读取信息
-        name = r.hget(f"user-{user_id}", 'name').decode('utf-8')
-        room_id = int(r.hget(f"user-{user_id}", 'roomId').decode('utf-8'))
-        email = r.hget(f"user-{user_id}", 'email').decode('utf-8')
-        dormitory = r.hget(f"user-{user_id}", 'dormitory').decode('utf-8')
-        bus_power = int(r.hget(f"user-{user_id}", 'busPower'))
-    except AttributeError:
-        user = User.query.get(user_id)
-        dormitory, bus_power = write_access_token_redis_cache(r, user)
-    else:
-        user = User(id=user_id, name=name, room_id=room_id, email=email)
+    try:
+        user, dormitory, bus_power = load_session(int(user_id))
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
     return jsonify(create_access_token(user, dormitory, bus_power))
 
@@ -217,19 +227,24 @@ def nfuca_sign_up() -> jsonify:
     try:
         data = loads(request.get_data().decode('utf-8'))
         sign = data['sign']
-        room_id = data['roomId']
+        room_id = int(data['roomId'])
         email = data['email']
     except (TypeError, ValueError):
         return jsonify({'code': '2000', 'message': '服务器内部错误'})
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    user_data = r.get(sign).decode('utf-8')
-    r.delete(sign)
+    if reference.get_dormitory(room_id) is None:
+        return jsonify({'code': '2000', 'message': '宿舍不存在'})
+
+    # 读取并删除签名，一次往返
+    pipe = redis.pipeline()
+    pipe.get(sign)
+    pipe.delete(sign)
+    user_data, _ = pipe.execute()
 
     if user_data is None:
         return jsonify({'code': '2000', 'message': '签名已过期'})
 
-    user_data = loads(user_data)['data']
+    user_data = loads(user_data.decode('utf-8'))['data']
     user = User.query.get(user_data['no'])
     if user is not None:
         return jsonify({'code': '2000', 'message': '该账号已存在'})
@@ -237,15 +252,13 @@ def nfuca_sign_up() -> jsonify:
     token = generate_token({'id': user_data['no']}, token_type='EMAIL_TOKEN')
     send_validate_email(email, user_data['name'], user_data['no'], token)
 
-    # 把帐号资料写入缓存
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    r.hmset(f"sign-up-{user_data['no']}", {
-        'name': user_data['name'],
-        'password': user_data['pwd'],
-        'roomId': room_id,
-        'email': email
-    })
-
-    # 设置缓存一小时过期
-    r.expire(user_data['no'], 3600)
+    # 把帐号资料写入缓存，并设置缓存一小时过期
+    with redis.batch() as pipe:
+        pipe.hmset(f"sign-up-{user_data['no']}", {
+            'name': user_data['name'],
+            'password': user_data['pwd'],
+            'roomId': room_id,
+            'email': email
+        })
+        pipe.expire(f"sign-up-{user_data['no']}", 3600)
     return jsonify({'code': '1000', 'message': '激活邮件已发送至您的邮箱，请查看'})
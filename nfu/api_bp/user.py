@@ -3,14 +3,15 @@ from json import decoder, loads
 from os import getenv
 
 from flask import Blueprint, g, jsonify, render_template, request
-from redis import Redis
 from requests import post
-from werkzeug.security import generate_password_hash
 
 from nfu.common import check_access_token, verification_code
-from nfu.expand.nfu import get_jw_token, get_profile
+from nfu.expand.password import password_hasher
+from nfu.expand.profile import get_profile_data
+from nfu.expand.reference import reference
+from nfu.expand.session import delete_session
 from nfu.extensions import db
-from nfu.models import College, Profession, Profile, User
+from nfu.models import User
 from nfu.nfu_error import NFUError
 
 user_bp = Blueprint('user', __name__)
@@ -23,72 +24,10 @@ def get_profile_api():
     获取学生个人信息
     :return:
     """
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-
     try:
-        # 首先向 Redis 读取缓存
-        grade = r.hget(f"profile-{g.user.id}", 'grade').decode('utf-8')
-        college = r.hget(f"profile-{g.user.id}", 'college').decode('utf-8')
-        profession = r.hget(f"profile-{g.user.id}", 'profession').decode('utf-8')
-        direction = r.hget(f"profile-{g.user.id}", 'direction').decode('utf-8')
-
-    except AttributeError:
-
-        # 向 MySQL 读取缓存
-        profile = Profile.query.get(g.user.id)
-
-        if profile is None:
-
-            try:
-                token = get_jw_token(g.user.id)
-                profile_data = get_profile(g.user.id, token)
-
-            except NFUError as err:
-                return jsonify({'code': err.code, 'message': err.message})
-
-            else:
-                profile = Profile(
-                    user_id=g.user.id,
-                    grade=profile_data['grade'],
-                    college_id=profile_data['college_id'],
-                    profession_id=profile_data['profession_id'],
-                    direction=profile_data['direction']
-                )
-
-                db.session.add(profile)
-                db.session.commit()
-
-            grade = profile_data['grade']
-            college = College.query.get(profile_data['college_id']).college
-            profession = Profession.query.get(profile_data['profession_id']).profession
-            direction = profile_data['direction']
-
-            r.hmset(f"profile-{g.user.id}", {
-                'grade': grade,
-                'college': college,
-                'profession': profession,
-                'direction': direction
-            })
-
-        else:
-            grade = profile.grade
-            college = College.query.get(profile.college_id).college
-            profession = Profession.query.get(profile.profession_id).profession
-            direction = profile.direction
-
-            r.hmset(f"profile-{g.user.id}", {
-                'grade': grade,
-                'college': college,
-                'profession': profession,
-                'direction': direction
-            })
-
-    return jsonify({'code': '1000', 'message': {
-        'grade': grade,
-        'college': college,
-        'profession': profession,
-        'direction': direction
-    }})
+        return jsonify({'code': '1000', 'message': get_profile_data(g.user)})
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
 
 @user_bp.route('/feedback', methods=['POST'])
@@ -136,14 +75,21 @@ def set_dormitory():
     更新宿舍信息
     :return:
     """
-    data = loads(request.get_data().decode('utf-8'))
+    try:
+        data = loads(request.get_data().decode('utf-8'))
+        room_id = int(data['roomId'])
+    except (TypeError, ValueError, KeyError):
+        return jsonify({'code': '2000', 'message': '请求数据错误'})
+
+    if reference.get_dormitory(room_id) is None:
+        return jsonify({'code': '2000', 'message': '宿舍不存在'})
+
     user = User.query.get(g.user.id)
-    user.room_id = int(data['roomId'])
+    user.room_id = room_id
     db.session.add(user)
     db.session.commit()
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    r.delete(f"user-{g.user.id}")
+    delete_session(g.user.id)
 
     return jsonify({'code': '1000', 'message': 'success'})
 
@@ -164,15 +110,22 @@ def set_password() -> jsonify:
         return jsonify({'code': '2000', 'message': '请求数据错误'})
 
     user = User.query.get(g.user.id)
-    if not user.validate_password(password):
-        return jsonify({'code': '0003', 'message': '密码错误'})
+    try:
+        if not password_hasher.verify(user, password):
+            return jsonify({'code': '0003', 'message': '密码错误'})
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
     try:  # 验证验证码是否正确
         verification_code(code)
     except NFUError as err:
         return jsonify({'code': err.code, 'message': err.message})
 
-    user.password = generate_password_hash(new_password)
+    try:
+        user.password = password_hasher.hash(new_password)
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
+
     db.session.add(user)
     db.session.commit()
 
@@ -195,8 +148,11 @@ def set_email() -> jsonify:
         return jsonify({'code': '2000', 'message': '请求数据错误'})
 
     user = User.query.get(g.user.id)
-    if not user.validate_password(password):
-        return jsonify({'code': '2000', 'message': '密码错误'})
+    try:
+        if not password_hasher.verify(user, password):
+            return jsonify({'code': '2000', 'message': '密码错误'})
+    except NFUError as err:
+        return jsonify({'code': err.code, 'message': err.message})
 
     try:  # 验证验证码是否正确
         verification_code(code)
@@ -207,7 +163,6 @@ def set_email() -> jsonify:
     db.session.add(user)
     db.session.commit()
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    r.delete(f"user-{g.user.id}")
+    delete_session(g.user.id)
 
     return jsonify({'code': '1000', 'message': '邮箱更新成功'})
@@ -1,14 +1,12 @@
-from os import getenv
 from random import randint
 
 from flask import Blueprint, g, jsonify
-from redis import Redis
-from werkzeug.security import generate_password_hash
 
 from nfu.common import check_access_token, get_token
 from nfu.expand.email import send_verification_code
+from nfu.expand.password import password_hasher
 from nfu.expand.token import validate_token
-from nfu.extensions import db
+from nfu.extensions import db, redis
 from nfu.models import User
 from nfu.nfu_error import NFUError
 
@@ -32,24 +30,41 @@ def activation() -> jsonify:
     if user is not None:
         return jsonify({'code': '2000', 'message': '该账号已激活'})
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
+    # 读取注册信息并删除缓存中的数据，一次往返
+    pipe = redis.pipeline()
+    pipe.hmget(f"sign-up-{validate['id']}", 'name', 'password', 'roomId', 'email')
+    pipe.delete(f"sign-up-{validate['id']}")
+    (name, password, room_id, email), _ = pipe.execute()
 
     try:  # 从 Redis 读取注册信息
-        name = r.hget(f"sign-up-{validate['id']}", 'name').decode('utf-8')
-        password = r.hget(f"sign-up-{validate['id']}", 'password').decode('utf-8')
-        room_id = r.hget(f"sign-up-{validate['id']}", 'roomId').decode('utf-8')
-        email = r.hget(f"sign-up-{validate['id']}", 'email').decode('utf-8')
+        name = name.decode('utf-8')
+        password = password.decode('utf-8')
+        room_id = room_id.decode('utf-8')
+        email = email.decode('utf-8')
     except AttributeError:
         return jsonify({'code': '2000', 'message': '该链接已失效'})
 
-    # 删除缓存中的数据
-    r.delete(f"sign-up-{validate['id']}")
+    try:
+        password_hash = password_hasher.hash(password)
+    except NFUError as err:
+
+        # 注册信息放回缓存，稍后可以再次激活
+        with redis.batch() as pipe:
+            pipe.hmset(f"sign-up-{validate['id']}", {
+                'name': name,
+                'password': password,
+                'roomId': room_id,
+                'email': email
+            })
+            pipe.expire(f"sign-up-{validate['id']}", 3600)
+
+        return jsonify({'code': err.code, 'message': err.message})
 
     # 把用户数据写入 MySql
     user = User(
         id=validate['id'],
         name=name,
-        password=generate_password_hash(password),
+        password=password_hash,
         room_id=room_id, email=email, jw_pwd=password
     )
     db.session.add(user)
@@ -68,8 +83,7 @@ def get_verification_code() -> jsonify:
 
     code = randint(100000, 999999)
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-    r.set(g.user.id, code, ex=300)
+    redis.set(g.user.id, code, ex=300)
 
     send_verification_code(g.user.email, g.user.name, code)
 
@@ -1,13 +1,14 @@
 import base64
 from functools import wraps
-from json import loads
-from os import getenv
+from math import ceil
 
-from flask import g, jsonify, request
-from redis import Redis
+from flask import current_app, g, jsonify, request
 
+from nfu.expand.rate_limit import hit
+from nfu.expand.school_config import get_config
 from nfu.expand.token import validate_token
-from nfu.models import BusUser, User
+from nfu.extensions import redis
+from nfu.models import BusUser
 from nfu.nfu_error import NFUError
 
 
@@ -37,13 +38,11 @@ def verification_code(code: int) -> None:
     :return:
     """
 
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-
     try:
-        if int(r.get(g.user.id)) == code:
+        if int(redis.get(g.user.id)) == code:
 
             # 删除缓存中的数据
-            r.delete(g.user.id)
+            redis.delete(g.user.id)
 
         else:
             raise NFUError('验证码错误', code='2001')
@@ -69,6 +68,75 @@ def get_token() -> str:
     return token
 
 
+def is_not_modified(etag) -> bool:
+    """
+    客户端持有的版本（If-None-Match）是否就是当前版本
+    :param etag: 当前版本，为 None 表示没有版本记录
+    :return:
+    """
+    return etag is not None and etag in request.if_none_match
+
+
+def not_modified(etag: str):
+    """
+    内容没有变化，返回不带正文的 304
+    :param etag:
+    :return:
+    """
+    return set_etag(current_app.response_class(status=304), etag)
+
+
+def json_response(payload: bytes):
+    """
+    直接返回已序列化的 JSON，省去 loads 再 jsonify 的开销
+    :param payload:
+    :return:
+    """
+    return current_app.response_class(payload, mimetype='application/json')
+
+
+def set_etag(response, etag):
+    """
+    给响应加上 ETag，并要求客户端每次使用前都带上 If-None-Match 重新验证
+    :param response:
+    :param etag: 为 None 时不做处理
+    :return:
+    """
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    return response
+
+
+class Principal:
+    """
+    当前请求的用户
+
+    只用令牌中的信息构造，不查询数据库；
+    教务系统密码只有访问教务系统的接口才需要，第一次读取时才从 Redis 获取
+    """
+    __slots__ = ('id', 'name', 'room_id', 'email', '_jw_pwd')
+
+    def __init__(self, user_id: int, claims: dict):
+        self.id = user_id
+        self.name = claims['name']
+        self.room_id = claims['roomId']
+        self.email = claims['email']
+        self._jw_pwd = None
+
+    @property
+    def jw_pwd(self) -> str:
+        if self._jw_pwd is None:
+            jw_pwd = redis.get(f'jw-{self.id}')
+            if jw_pwd is None:
+                raise NFUError('请重新登录', code='1001')
+
+            self._jw_pwd = jw_pwd.decode('utf-8')
+
+        return self._jw_pwd
+
+
 def get_school_config(func):
     """
     获取当前学年学期等基本配置
@@ -79,11 +147,7 @@ def get_school_config(func):
 
     @wraps(func)
     def wrapper(*args, **kw):
-        g.school_config = {
-            'schoolYear': 2020,
-            'semester': 2,
-            'schoolOpensTimestamp': 1614528000000
-        }
+        g.school_config = get_config()
 
         return func(*args, **kw)
 
@@ -110,21 +174,51 @@ def check_access_token(func):
         except NFUError as err:
             return jsonify({'code': err.code, 'message': err.message})
 
-        r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-        user_data = loads(validate['data'])
-        g.user = User(
-            id=validate['id'],
-            name=user_data["name"],
-            room_id=user_data["roomId"],
-            email=user_data["email"],
-            jw_pwd=r.get(f"jw-{validate['id']}").decode('utf-8')
-        )
+        g.user = Principal(validate['id'], validate)
 
         return func(*args, **kw)
 
     return wrapper
 
 
+def rate_limit(name: str):
+    """
+    按学号与 IP 限制请求频率，规则在 RATE_LIMITS[name] 中配置
+
+    放在 check_access_token 之后使用时按令牌中的学号限制，
+    登录、注册等没有令牌的接口按请求数据中的 userId 限制；
+    RATE_LIMIT_BY_IP 打开时才按 IP 限制
+
+    :param name: 限流规则名
+    :return: 装饰器
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if 'user' in g:
+                user_id = g.user.id
+            else:
+                data = request.get_json(force=True, silent=True)
+                user_id = data.get('userId') if isinstance(data, dict) else None
+
+            ip = request.remote_addr if current_app.config['RATE_LIMIT_BY_IP'] else None
+
+            wait = hit(name, {'user': user_id, 'ip': ip})
+            if wait:
+                response = jsonify({'code': '2002', 'message': '请求过于频繁，请稍后再试'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(ceil(wait))
+                return response
+
+            return func(*args, **kw)
+
+        return wrapper
+
+    return decorator
+
+
 def check_power_school_bus(func):
     """
     检查用户否具有校车功能的权限
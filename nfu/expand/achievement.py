@@ -1,9 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
+from json import dumps
 from re import sub
+from time import time
 
-from nfu.expand.nfu import get_achievement_list, get_jw_token
-from nfu.extensions import db
+from flask import current_app
+
+from nfu.expand.bulk import bulk_delete, bulk_insert, bulk_update
+from nfu.expand.cache import ReadThroughCache
+from nfu.expand.nfu import call_with_jw_token, get_achievement_list
+from nfu.extensions import db, redis
 from nfu.models import Achievement
 
+achievement_cache = ReadThroughCache('achievement-cache')
+
+
+def get_achievement(user, school_year_now: int, semester_now: int) -> list:
+    """
+    获取成绩单，依次查缓存、数据库、教务系统
+    :param user: 有 id 和 jw_pwd 的用户，需要访问教务系统时才读取 jw_pwd
+    :param school_year_now:
+    :param semester_now:
+    :return:
+    """
+
+    def loader():
+        achievement_db = query_achievement(user.id).all()
+
+        # 数据库存在成绩数据
+        if achievement_db:
+            return db_get(achievement_db)
+
+        return db_init(user.id, user.jw_pwd, school_year_now, semester_now)
+
+    return achievement_cache.get(achievement_cache.key(user.id), loader)
+
+
+def query_achievement(user_id: int):
+    """
+    用户的全部成绩，按学期排序
+    :param user_id:
+    :return:
+    """
+    return Achievement.query.filter_by(user_id=user_id).order_by(
+        Achievement.school_year,
+        Achievement.semester,
+        Achievement.id
+    )
+
+
+def query_semester(user_id: int, school_year: int, semester: int):
+    """
+    用户某个学期的成绩
+    :param user_id:
+    :param school_year:
+    :param semester:
+    :return:
+    """
+    return Achievement.query.filter_by(user_id=user_id, school_year=school_year, semester=semester)
+
 
 def db_get(achievement_db) -> list:
     """
@@ -27,68 +82,129 @@ def db_init(user_id: int, jw_pwd: str, school_year_now: int, semester_now: int)
     :param semester_now:
     :return:
     """
-    achievement_list = __get(user_id, jw_pwd, school_year_now, semester_now)
+    school_year_list = __get_school_year_list(user_id, school_year_now, semester_now)
+    semesters = __get(user_id, jw_pwd, school_year_list)
+
+    achievement_list = []
+    for item in school_year_list:
+        achievement_list.extend(semesters[item])
 
     # 接下来把数据写入数据库
     __db_input(user_id, achievement_list)
 
+    # 记录每个学期的内容摘要，之后的更新只需对比摘要
+    redis.delete(f'achievement-version-{user_id}', f'achievement-changed-{user_id}')
+    __save_version(user_id, semesters, changed=False)
+
+    achievement_cache.set(achievement_cache.key(user_id), achievement_list)
     return achievement_list
 
 
 def db_update(user_id: int, jw_pwd: str, school_year_now: int, semester_now: int) -> list:
     """
-    更新成绩单
+    增量更新成绩单
+
+    只向教务系统请求当前学期、最近有变动的学期、以及没有摘要记录的学期，
+    与已记录的内容摘要对比，只把有变化的课程写入数据库，并在同一个事务中提交
+
     :param jw_pwd:
     :param user_id:
     :param school_year_now:
     :param semester_now:
     :return:
     """
-    achievement_list = __get(user_id, jw_pwd, school_year_now, semester_now)
+    school_year_list = __get_school_year_list(user_id, school_year_now, semester_now)
 
-    # 从数据库删除已有的记录
-    achievement_db = Achievement.query.filter_by(user_id=user_id).all()
-    for course in achievement_db:
-        db.session.delete(course)
+    pipe = redis.pipeline()
+    pipe.hgetall(f'achievement-version-{user_id}')
+    pipe.hgetall(f'achievement-changed-{user_id}')
+    version, changed = pipe.execute()
 
-    # 提交删除请求
-    db.session.commit()
+    recent = time() - current_app.config['ACHIEVEMENT_RECENT_DAYS'] * 86400
+    sync_list = []
+    for item in school_year_list:
+        field = __field(item).encode('utf-8')
 
-    # 接下来把数据写入数据库
-    __db_input(user_id, achievement_list)
+        if item == (school_year_now, semester_now) or field not in version or float(changed.get(field, 0)) > recent:
+            sync_list.append(item)
 
-    return achievement_list
+    semesters = __get(user_id, jw_pwd, sync_list)
+
+    # 只保留内容有变化的学期
+    semesters = {
+        item: achievement
+        for item, achievement in semesters.items()
+        if version.get(__field(item).encode('utf-8')) != __hash(achievement).encode('utf-8')
+    }
 
+    if semesters:
+        __db_sync(user_id, semesters)
+        __save_version(user_id, semesters, changed=True)
 
-def __get(user_id: int, jw_pwd: str, school_year_now: int, semester_now: int) -> list:
+    achievement_db = query_achievement(user_id).all()
+
+    achievement = db_get(achievement_db)
+    achievement_cache.set(achievement_cache.key(user_id), achievement)
+    return achievement
+
+
+def get_version(user_id: int):
+    """
+    成绩单的版本号，由各学期的内容摘要合成，用作 ETag
+    :param user_id:
+    :return: 没有摘要记录时返回 None
+    """
+    version = redis.hgetall(f'achievement-version-{user_id}')
+    if not version:
+        return None
+
+    return md5(b','.join(field + b'=' + version[field] for field in sorted(version))).hexdigest()
+
+
+def __get(user_id: int, jw_pwd: str, school_year_list: list) -> dict:
     """
     向教务系统请求数据，
     :param jw_pwd:
     :param user_id:
-    :param school_year_now:
-    :param semester_now:
-    :return:
+    :param school_year_list:
+    :return: {(学年, 学期): 成绩列表}
     """
+    if not school_year_list:
+        return {}
 
-    token = get_jw_token(user_id, jw_pwd)
+    concurrency = current_app.config['ACHIEVEMENT_FETCH_CONCURRENCY']
 
-    achievement_list = []
-    school_year_list = __get_school_year_list(user_id, school_year_now, semester_now)
+    return call_with_jw_token(user_id, jw_pwd, __get_by_token, school_year_list, concurrency)
 
-    for item in school_year_list:
-        # 向教务系统请求数据
-        achievement_data = get_achievement_list(token, item[0], item[1])
 
-        # 判断返回的数据是否为空
-        if not achievement_data:
-            continue
+def __get_by_token(token: str, school_year_list: list, concurrency: int) -> dict:
+    """
+    向教务系统请求各个学期的成绩
 
-        achievement = __data_processing(achievement_data, item[0], item[1])
+    最多同时请求 concurrency 个学期，结果按学期顺序合并；
+    gevent worker 下线程已被 monkey patch 成协程，同样适用
 
-        # 此数据，为接口返回的数据
-        achievement_list.extend(achievement)
+    :param token:
+    :param school_year_list:
+    :param concurrency: 并发数
+    :return:
+    """
+    if concurrency > 1 and len(school_year_list) > 1:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(school_year_list))) as executor:
+            achievement_data_list = list(executor.map(
+                lambda item: get_achievement_list(token, item[0], item[1]),
+                school_year_list
+            ))
+    else:
+        achievement_data_list = [get_achievement_list(token, item[0], item[1]) for item in school_year_list]
 
-    return achievement_list
+    semesters = {}
+    for item, achievement_data in zip(school_year_list, achievement_data_list):
+
+        # 此数据，为接口返回的数据，返回的数据为空的学期，也记录下来
+        semesters[item] = __data_processing(achievement_data or [], item[0], item[1])
+
+    return semesters
 
 
 def __get_school_year_list(user_id: int, school_year_now: int, semester_now: int) -> list:
@@ -116,6 +232,72 @@ def __get_school_year_list(user_id: int, school_year_now: int, semester_now: int
     return school_year_list
 
 
+def __field(item: tuple) -> str:
+    """
+    学期在摘要记录中的字段名
+    :param item: (学年, 学期)
+    :return:
+    """
+    return f'{item[0]}-{item[1]}'
+
+
+def __hash(achievement: list) -> str:
+    """
+    一个学期成绩的内容摘要
+    :param achievement:
+    :return:
+    """
+    return md5(dumps(achievement, sort_keys=True).encode(encoding='UTF-8')).hexdigest()
+
+
+def __save_version(user_id: int, semesters: dict, changed: bool) -> None:
+    """
+    写入各学期的内容摘要
+    :param user_id:
+    :param semesters:
+    :param changed: 是否记录为最近有变动
+    :return:
+    """
+    if not semesters:
+        return
+
+    now = time()
+
+    with redis.batch() as pipe:
+        pipe.hmset(f'achievement-version-{user_id}', {
+            __field(item): __hash(achievement) for item, achievement in semesters.items()
+        })
+
+        if changed:
+            pipe.hmset(f'achievement-changed-{user_id}', {__field(item): now for item in semesters})
+
+
+def __to_row(user_id: int, course: dict) -> dict:
+    """
+    把成绩转换成数据库的字段
+    :param user_id:
+    :param course:
+    :return:
+    """
+    return {
+        'user_id': user_id,
+        'school_year': course['schoolYear'],
+        'semester': course['semester'],
+        'course_type': course['courseType'],
+        'subdivision_type': course['subdivisionType'],
+        'course_name': course['courseName'],
+        'course_id': course['courseId'],
+        'credit': course['credit'],
+        'achievement_point': course['achievementPoint'],
+        'final_achievements': course['finalAchievements'],
+        'total_achievements': course['totalAchievements'],
+        'midterm_achievements': course['midtermAchievements'],
+        'practice_achievements': course['practiceAchievements'],
+        'peacetime_achievements': course['peacetimeAchievements'],
+        'resit_exam_achievement_point': course['resitExamAchievementPoint']
+    }
+
+
 def __db_input(user_id: int, achievement_list: list) -> None:
     """
     往数据库写入数据
@@ -123,27 +305,49 @@ def __db_input(user_id: int, achievement_list: list) -> None:
     :param achievement_list:
     :return:
     """
-    for course in achievement_list:
-        achievement_db = Achievement(
-            user_id=user_id,
-            school_year=course['schoolYear'],
-            semester=course['semester'],
-            course_type=course['courseType'],
-            subdivision_type=course['subdivisionType'],
-            course_name=course['courseName'],
-            course_id=course['courseId'],
-            credit=course['credit'],
-            achievement_point=course['achievementPoint'],
-            final_achievements=course['finalAchievements'],
-            total_achievements=course['totalAchievements'],
-            midterm_achievements=course['midtermAchievements'],
-            practice_achievements=course['practiceAchievements'],
-            peacetime_achievements=course['peacetimeAchievements'],
-            resit_exam_achievement_point=course['resitExamAchievementPoint']
-        )
-
-        db.session.add(achievement_db)
+    bulk_insert(Achievement, [__to_row(user_id, course) for course in achievement_list])
+    db.session.commit()
+
+
+def __db_sync(user_id: int, semesters: dict) -> None:
+    """
+    把有变化的学期同步到数据库
+
+    按课程对比，只更新变化的行、插入新增的课程、删除已不存在的课程，
+    所有改动在同一个事务中提交，读者不会看到成绩单为空的中间状态
+
+    :param user_id:
+    :param semesters: {(学年, 学期): 成绩列表}
+    :return:
+    """
+    insert_rows, update_rows, delete_ids = [], [], []
+
+    for (school_year, semester), achievement in semesters.items():
+        existing = {}
+        for course_db in query_semester(user_id, school_year, semester):
+            existing.setdefault(course_db.course_id, []).append(course_db)
+
+        for course in achievement:
+            row = __to_row(user_id, course)
+
+            try:
+                course_db = existing[row['course_id']].pop()
+            except (KeyError, IndexError):
+                insert_rows.append(row)
+                continue
+
+            if any(getattr(course_db, key) != value for key, value in row.items()):
+                update_rows.append({'id': course_db.id, **row})
+
+        # 教务系统已不存在的课程
+        for course_list in existing.values():
+            delete_ids.extend(course_db.id for course_db in course_list)
+
+    if delete_ids:
+        bulk_delete(Achievement, Achievement.id.in_(delete_ids))
 
+    bulk_update(Achievement, update_rows)
+    bulk_insert(Achievement, insert_rows)
     db.session.commit()
 
 
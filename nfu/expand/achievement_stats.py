@@ -0,0 +1,97 @@
+import numpy as np
+
+from nfu.extensions import db
+from nfu.models import Achievement
+
+# 及格线
+PASS_ACHIEVEMENT = 60
+
+# 补考及格的课程，绩点按 1.0 计算
+RESIT_ACHIEVEMENT_POINT = 1.0
+
+
+def get_achievement_stats(user_id: int) -> dict:
+    """
+    根据数据库中的成绩单，计算每学期及累计的学分、平均成绩与平均绩点
+
+    - 字段说明
+        - selectedCredit 已选学分
+        - getCredit 已获得学分，总评或补考及格的课程
+        - averageAchievement 按学分加权的平均成绩
+        - averageAchievementPoint 按学分加权的平均绩点
+        - resitAverageAchievement 计入补考成绩后的平均成绩
+        - resitAverageAchievementPoint 计入补考成绩后的平均绩点
+
+    :param user_id:
+    :return:
+    """
+    rows = db.session.query(
+        Achievement.school_year,
+        Achievement.semester,
+        Achievement.credit,
+        Achievement.achievement_point,
+        Achievement.total_achievements,
+        Achievement.resit_exam_achievement_point
+    ).filter_by(user_id=user_id).all()
+
+    if not rows:
+        return {'semesters': [], 'total': None}
+
+    data = np.array(rows, dtype=float)
+    school_year, semester, credit, point, achievement, resit = data.T
+
+    # 补考成绩，没有补考的记为 nan
+    resit_passed = np.nan_to_num(resit, nan=-1) >= PASS_ACHIEVEMENT
+    resit_achievement = np.where(np.isnan(resit), achievement, np.fmax(achievement, resit))
+    resit_point = np.where(resit_passed & (point < RESIT_ACHIEVEMENT_POINT), RESIT_ACHIEVEMENT_POINT, point)
+    passed = (achievement >= PASS_ACHIEVEMENT) | resit_passed
+
+    # 按学期分组，group 为每门课程所在学期的下标
+    semester_key, group = np.unique(school_year * 10 + semester, return_inverse=True)
+
+    sums = np.vstack([
+        np.bincount(group, weights=credit),
+        np.bincount(group, weights=credit * passed),
+        np.bincount(group, weights=credit * achievement),
+        np.bincount(group, weights=credit * point),
+        np.bincount(group, weights=credit * resit_achievement),
+        np.bincount(group, weights=credit * resit_point)
+    ])
+
+    semester_stats = __summarize(sums)
+    total_stats = __summarize(np.cumsum(sums, axis=1))
+
+    semesters = []
+    for i, key in enumerate(semester_key.astype(int).tolist()):
+        semesters.append({
+            'schoolYear': key // 10,
+            'semester': key % 10,
+            **semester_stats[i],
+            'cumulative': total_stats[i]
+        })
+
+    return {'semesters': semesters, 'total': total_stats[-1]}
+
+
+def __summarize(sums) -> list:
+    """
+    把学分与加权和换算成平均值
+    :param sums: 6 行的数组，依次为已选学分、已获学分、各项按学分加权的和
+    :return: 每一列对应的统计数据
+    """
+    selected_credit = sums[0]
+    averages = np.divide(sums[2:], selected_credit, out=np.zeros_like(sums[2:]), where=selected_credit > 0)
+    averages = np.round(averages, 2)
+
+    result = []
+    for i in range(sums.shape[1]):
+        result.append({
+            'selectedCredit': float(selected_credit[i]),
+            'getCredit': float(sums[1][i]),
+            'averageAchievement': float(averages[0][i]),
+            'averageAchievementPoint': float(averages[1][i]),
+            'resitAverageAchievement': float(averages[2][i]),
+            'resitAverageAchievementPoint': float(averages[3][i])
+        })
+
+    return result
@@ -0,0 +1,40 @@
+from nfu.extensions import db
+
+
+def bulk_insert(model, rows: list, ignore: bool = False) -> None:
+    """
+    一条多行 INSERT 写入数据，不创建 ORM 对象
+    :param model: 模型
+    :param rows: 字段名与值的字典列表
+    :param ignore: 是否忽略违反唯一索引的行
+    :return:
+    """
+    if rows:
+        statement = model.__table__.insert()
+
+        if ignore:
+            statement = statement.prefix_with('IGNORE', dialect='mysql').prefix_with('OR IGNORE', dialect='sqlite')
+
+        db.session.execute(statement, rows)
+
+
+def bulk_update(model, rows: list) -> None:
+    """
+    按主键批量更新
+    :param model: 模型
+    :param rows: 带主键的字段字典列表
+    :return:
+    """
+    if rows:
+        db.session.bulk_update_mappings(model, rows)
+
+
+def bulk_delete(model, *criterion, **filters) -> int:
+    """
+    一条 DELETE 删除所有满足条件的行
+    :param model: 模型
+    :param criterion: 过滤表达式
+    :param filters: 等值过滤条件
+    :return: 删除的行数
+    """
+    return model.query.filter(*criterion).filter_by(**filters).delete(synchronize_session=False)
@@ -0,0 +1,179 @@
+from json import dumps, loads
+from threading import Thread
+from time import monotonic, sleep, time
+
+from flask import current_app
+from redis.exceptions import LockError
+
+from nfu.extensions import redis
+from nfu.nfu_error import NFUError
+
+
+class ReadThroughCache:
+    """
+    读穿缓存
+
+    - 缓存未过期时直接返回
+    - 过期但仍在 stale 时间内时，先返回旧数据，由一个进程在后台重新加载
+    - 缓存不存在时，同一个键只有一个进程加载，其余进程等待它写入的缓存
+    - 加载时教务系统出错，错误也缓存一小段时间，避免所有请求都去重试
+
+    各类数据的 (有效期, 过期后仍可使用的时间) 在 CACHE_TTLS 中配置，单位为秒
+    """
+
+    # 等待其他进程加载时，每次检查缓存的间隔
+    wait_interval = 0.05
+
+    def __init__(self, name: str, ttl: int = 3600, stale_ttl: int = 86400):
+        self.name = name
+        self.default_ttl = (ttl, stale_ttl)
+
+    def key(self, *parts) -> str:
+        """
+        缓存键
+        :param parts:
+        :return:
+        """
+        return '-'.join([self.name, *(str(part) for part in parts)])
+
+    @property
+    def ttl(self) -> tuple:
+        return current_app.config['CACHE_TTLS'].get(self.name, self.default_ttl)
+
+    def get(self, key: str, loader):
+        """
+        读取缓存，没有缓存时调用 loader 加载
+        :param key:
+        :param loader: 没有参数的加载函数，返回值需要能被 JSON 序列化
+        :return:
+        """
+        entry = self.__read(key)
+
+        if entry is None:
+            return self.__fill(key, loader)
+
+        if entry['expires'] < time() and 'value' in entry:
+            self.__revalidate(key, loader)
+
+        return self.__unwrap(entry)
+
+    def set(self, key: str, value, pipe=None) -> None:
+        """
+        写入缓存，数据更新后由调用者直接写入
+        :param key:
+        :param value:
+        :param pipe: 与其他命令一起发送时传入 pipeline
+        :return:
+        """
+        ttl, stale_ttl = self.ttl
+        (pipe or redis).set(key, dumps({'expires': time() + ttl, 'value': value}), ex=ttl + stale_ttl)
+
+    def peek(self, key: str):
+        """
+        只读取缓存，不加载，也不管是否过期
+        :param key:
+        :return: 没有缓存或缓存的是错误时返回 None
+        """
+        entry = self.__read(key)
+        return None if entry is None else entry.get('value')
+
+    def delete(self, key: str) -> None:
+        redis.delete(key)
+
+    def __read(self, key: str):
+        entry = redis.get(key)
+        return None if entry is None else loads(entry)
+
+    @staticmethod
+    def __unwrap(entry: dict):
+        if 'error' in entry:
+            raise NFUError(entry['error'][1], code=entry['error'][0])
+
+        return entry['value']
+
+    def __lock(self, key: str):
+
+        # 后台加载时由另一个线程释放锁，不能使用线程本地的令牌
+        return redis.lock(f'{key}-lock', timeout=current_app.config['CACHE_LOCK_TIMEOUT'], thread_local=False)
+
+    def __load(self, key: str, loader):
+        """
+        加载数据并写入缓存，出错时缓存错误信息
+        :param key:
+        :param loader:
+        :return:
+        """
+        try:
+            value = loader()
+        except NFUError as err:
+            error_ttl = current_app.config['CACHE_ERROR_TTL']
+            redis.set(key, dumps({'expires': time() + error_ttl, 'error': [err.code, err.message]}), ex=error_ttl)
+            raise
+
+        self.set(key, value)
+        return value
+
+    def __fill(self, key: str, loader):
+        """
+        缓存不存在时加载，同一个键只有一个进程真正加载
+        :param key:
+        :param loader:
+        :return:
+        """
+        lock = self.__lock(key)
+        deadline = monotonic() + current_app.config['CACHE_LOCK_TIMEOUT']
+
+        while not lock.acquire(blocking=False):
+            sleep(self.wait_interval)
+
+            entry = self.__read(key)
+            if entry is not None:
+                return self.__unwrap(entry)
+
+            # 持有锁的进程可能已经崩溃，不再等待
+            if monotonic() > deadline:
+                return self.__load(key, loader)
+
+        try:
+
+            # 拿到锁之前，其他进程可能刚写入缓存
+            entry = self.__read(key)
+            if entry is not None:
+                return self.__unwrap(entry)
+
+            return self.__load(key, loader)
+
+        finally:
+            self.__release(lock)
+
+    def __revalidate(self, key: str, loader) -> None:
+        """
+        在后台重新加载已过期的缓存，同一个键只有一个进程加载
+        :param key:
+        :param loader:
+        :return:
+        """
+        lock = self.__lock(key)
+        if not lock.acquire(blocking=False):
+            return
+
+        Thread(target=self.__refresh, args=(current_app._get_current_object(), key, loader, lock), daemon=True).start()
+
+    def __refresh(self, app, key: str, loader, lock) -> None:
+        with app.app_context():
+            try:
+                self.set(key, loader())
+
+            # 后台加载失败时保留旧数据，等下次过期再试
+            except NFUError:
+                pass
+
+            finally:
+                self.__release(lock)
+
+    @staticmethod
+    def __release(lock) -> None:
+        try:
+            lock.release()
+        except LockError:
+            pass
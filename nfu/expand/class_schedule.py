@@ -1,120 +1,435 @@
-from hashlib import md5
+from hashlib import blake2b, md5
 from json import dumps, loads
 
-from nfu.expand.nfu import get_class_schedule, get_jw_token
-from nfu.extensions import db
-from nfu.models import ClassSchedule
+from nfu.expand.bulk import bulk_delete, bulk_insert, bulk_update
+from nfu.expand.cache import ReadThroughCache
+from nfu.expand.free_room import mark_changed
+from nfu.expand.jw_client import JWClient
+from nfu.expand.nfu import call_with_jw_token, get_class_schedule, get_class_schedule_raw, parse_class_schedule
+from nfu.extensions import db, redis
+from nfu.models import ClassSchedule, CourseSection
+from nfu.nfu_error import JWTokenRejected
 
+# 课程表只在同步时变化，有效期设得长一些
+schedule_cache = ReadThroughCache('class-schedule', ttl=30 * 86400, stale_ttl=30 * 86400)
 
-def db_init(user_id: int, jw_pwd: str, school_year: int, semester: int, redis) -> list:
+
+def get_sections(user, school_year: int, semester: int) -> tuple:
+    """
+    获取课程表的上课时间段 id，依次查缓存、数据库、教务系统
+    :param user: 有 id 和 jw_pwd 的用户，需要访问教务系统时才读取 jw_pwd
+    :param school_year:
+    :param semester:
+    :return: 上课时间段 id, 版本号
+    """
+    class_schedule = schedule_cache.get(
+        schedule_cache.key(school_year, semester, user.id),
+        lambda: __load(user, school_year, semester)
+    )
+
+    return class_schedule['sections'], class_schedule['version']
+
+
+def get_version(user_id: int, school_year: int, semester: int):
     """
-    数据库没有课表数据时，调用此函数写入数据
+    获取缓存的版本号
+    :param user_id:
+    :param school_year:
+    :param semester:
+    :return: 没有缓存时返回 None
+    """
+    class_schedule = schedule_cache.peek(schedule_cache.key(school_year, semester, user_id))
+    return None if class_schedule is None else class_schedule['version']
+
+
+def db_update(user_id: int, jw_pwd: str, school_year: int, semester: int) -> tuple:
+    """
+    更新数据库中的课表数据
+
+    先对教务系统返回的原始数据做摘要，与上次相同则直接返回缓存，
+    不再解析、排序、序列化；不同时才解析，解析后的内容有变化才写入数据库
+
     :param jw_pwd:
-    :param redis:
     :param user_id:
     :param school_year:
     :param semester:
-    :return:
+    :return: 完整的响应数据, 版本号
     """
 
-    token = get_jw_token(user_id, jw_pwd)
-    class_schedule_api = get_class_schedule(token, school_year, semester)
+    # 先尝试连接教务系统，看是否能获取课程数据
+    raw = call_with_jw_token(user_id, jw_pwd, get_class_schedule_raw, school_year, semester)
+    class_schedule_raw_version = raw_version(raw)
+
+    key = schedule_cache.key(school_year, semester, user_id)
+    cache_raw_version = redis.get(f'class-schedule-raw-version-{school_year}-{semester}-{user_id}')
+    class_schedule = schedule_cache.peek(key)
+
+    # 原始数据没有变化
+    if cache_raw_version is not None and cache_raw_version.decode('utf-8') == class_schedule_raw_version \
+            and class_schedule is not None:
+        return get_payload(class_schedule['sections'], class_schedule['version']), class_schedule['version']
+
+    try:
+        class_schedule_api = parse_class_schedule(raw)
+    except (JWTokenRejected, *JWClient.retry_errors):
+
+        # 原始数据有问题，按正常流程重新请求，失败会自动重试
+        raw, class_schedule_api = call_with_jw_token(user_id, jw_pwd, get_class_schedule, school_year, semester)
+        class_schedule_raw_version = raw_version(raw)
 
     version = md5(dumps(class_schedule_api).encode(encoding='UTF-8')).hexdigest()
-    redis.set(f'class-schedule-version-{user_id}', version)
 
-    class_schedule = __db_input(user_id, class_schedule_api, school_year, semester)
-    redis.set(f'class-schedule-{user_id}', dumps(class_schedule))
-    return class_schedule
+    # 若检测到数据有更新，则写入mysql
+    if class_schedule is None or class_schedule['version'] != version:
+
+        old_ids = {row.section_id for row in query_schedule(user_id, school_year, semester)}
+
+        # 删除旧数据与写入新数据在同一个事务中
+        bulk_delete(ClassSchedule, user_id=user_id, school_year=school_year, semester=semester)
+        class_schedule = {
+            'sections': __db_input(user_id, class_schedule_api, school_year, semester),
+            'version': version
+        }
+
+        # 不再选的上课时间段可能已经没有人选，所在的教室也要重建
+        dropped = old_ids.difference(class_schedule['sections'])
+        if dropped:
+            mark_changed(school_year, semester, {row.classroom for row in db.session.query(
+                CourseSection.classroom
+            ).filter(CourseSection.id.in_(dropped))})
 
+    # 原始数据的摘要与缓存一起写入，缓存重新计算有效期
+    with redis.batch() as pipe:
+        pipe.set(f'class-schedule-raw-version-{school_year}-{semester}-{user_id}', class_schedule_raw_version)
+        schedule_cache.set(key, class_schedule, pipe)
 
-def db_update(user_id: int, jw_pwd: str, school_year: int, semester: int, redis) -> list:
+    return get_payload(class_schedule['sections'], version), version
+
+
+def query_schedule(user_id: int, school_year: int, semester: int):
     """
-    更新数据库中的课表数据
-    :param jw_pwd:
-    :param redis:
+    用户某个学期课程表的上课时间段 id，按课程表的顺序
     :param user_id:
     :param school_year:
     :param semester:
     :return:
     """
+    return db.session.query(ClassSchedule.section_id).filter_by(
+        user_id=user_id,
+        school_year=school_year,
+        semester=semester
+    ).order_by(ClassSchedule.id)
 
-    token = get_jw_token(user_id, jw_pwd)
 
-    # 先尝试连接教务系统，看是否能获取课程数据
-    class_schedule_api = get_class_schedule(token, school_year, semester)
-    version = md5(dumps(class_schedule_api).encode(encoding='UTF-8')).hexdigest()
+def query_course_sections(school_year: int, semester: int, course_ids):
+    """
+    某个学期若干教学班的全部上课时间段
+    :param school_year:
+    :param semester:
+    :param course_ids:
+    :return:
+    """
+    return CourseSection.query.filter_by(school_year=school_year, semester=semester).filter(
+        CourseSection.course_id.in_(course_ids)
+    )
 
-    class_schedule_version = redis.get(f'class-schedule-version-{user_id}')
 
-    # 若检测到数据有更新，则写入mysql
-    if class_schedule_version is None or class_schedule_version.decode('utf-8') != version:
+def get_payload(section_ids: list, version: str) -> bytes:
+    """
+    用各个上课时间段已序列化的 JSON 拼接成完整的响应，不需要 loads 再 dumps
+    :param section_ids:
+    :param version:
+    :return:
+    """
+    return to_payload(get_section_json(section_ids), version)
 
-        class_schedule_db = ClassSchedule.query.filter_by(
-            user_id=user_id,
-            school_year=school_year,
-            semester=semester
-        ).all()
 
-        for course in class_schedule_db:
-            db.session.delete(course)
+def to_payload(fragments: list, version: str, **extra) -> bytes:
+    """
+    把已序列化的课程拼接成完整的响应
+    :param fragments: 各个上课时间段的 JSON
+    :param version:
+    :param extra: 响应中的其他字段
+    :return:
+    """
+    fields = ''.join(f', {dumps(key)}: {dumps(value)}' for key, value in extra.items())
+    return b'{"code": "1000", "message": [' + b', '.join(fragments) + \
+        f'], "version": {dumps(version)}{fields}}}'.encode('utf-8')
+
+
+def get_section_json(section_ids: list) -> list:
+    """
+    获取上课时间段的 JSON，同一教学班的同学共用同一份缓存
+    :param section_ids:
+    :return:
+    """
+    if not section_ids:
+        return []
+
+    fragments = redis.mget([f'course-section-{section_id}' for section_id in section_ids])
+    missing = [section_id for section_id, fragment in zip(section_ids, fragments) if fragment is None]
+
+    # 缓存中没有的，从数据库读取并补上
+    if missing:
+        sections = {section.id: section for section in CourseSection.query.filter(CourseSection.id.in_(missing))}
+
+        with redis.batch() as pipe:
+            for section in sections.values():
+                pipe.set(f'course-section-{section.id}', section.get_json())
+
+        fragments = [
+            fragment if fragment is not None else sections[section_id].get_json().encode('utf-8')
+            for section_id, fragment in zip(section_ids, fragments)
+            if fragment is not None or section_id in sections
+        ]
+
+    return fragments
+
+
+def raw_version(raw: bytes) -> str:
+    """
+    原始数据的摘要，blake2b 比 md5 更快
+    :param raw:
+    :return:
+    """
+    return blake2b(raw, digest_size=16).hexdigest()
+
 
-        db.session.commit()
+def __load(user, school_year: int, semester: int) -> dict:
+    """
+    从数据库读取课程表的上课时间段，没有则向教务系统获取并写入数据库
+    :param user:
+    :param school_year:
+    :param semester:
+    :return:
+    """
+    user_id = user.id
+    section_ids = [row.section_id for row in query_schedule(user_id, school_year, semester)]
+
+    # 数据库中没有版本号，用各个上课时间段的内容计算，内容变化了版本号才会变化
+    if section_ids:
+        return {'sections': section_ids, 'version': __content_version(section_ids)}
 
-        # 写入缓存
-        class_schedule = __db_input(user_id, class_schedule_api, school_year, semester)
-        redis.set(f'class-schedule-version-{user_id}', version)
-        redis.set(f'class-schedule-{user_id}', dumps(class_schedule))
+    raw, class_schedule_api = call_with_jw_token(user_id, user.jw_pwd, get_class_schedule, school_year, semester)
 
-    else:  # 否则直接读取缓存数据
-        class_schedule = redis.get(f'class-schedule-{user_id}').decode('utf-8')
-        class_schedule = loads(class_schedule)
+    version = md5(dumps(class_schedule_api).encode(encoding='UTF-8')).hexdigest()
+    section_ids = __db_input(user_id, class_schedule_api, school_year, semester)
+    redis.set(f'class-schedule-raw-version-{school_year}-{semester}-{user_id}', raw_version(raw))
 
-    return class_schedule
+    return {'sections': section_ids, 'version': version}
 
 
-def __db_input(user_id, class_schedule_list: list, school_year: int, semester: int) -> list:
+def __db_input(user_id: int, class_schedule_list: list, school_year: int, semester: int) -> list:
     """
     把课程表写入数据库
+    :param user_id:
     :param class_schedule_list:
     :param school_year:
     :param semester:
+    :return: 上课时间段 id
+    """
+    section_ids, index, fragments, classrooms, updated = __save_sections(class_schedule_list, school_year, semester)
+
+    bulk_insert(ClassSchedule, [{
+        'user_id': user_id,
+        'school_year': school_year,
+        'semester': semester,
+        'section_id': section_id
+    } for section_id in section_ids])
+
+    db.session.commit()
+
+    # 提交之后再写缓存，避免缓存指向回滚掉的时间段
+    if index:
+        with redis.batch() as pipe:
+            pipe.hmset(f'course-section-ids-{school_year}-{semester}', index)
+
+            for section_id, fragment in fragments.items():
+                pipe.set(f'course-section-{section_id}', fragment)
+
+    # 有新的或变化的上课时间段，教室占用位图需要重建
+    mark_changed(school_year, semester, classrooms)
+
+    if updated:
+        __refresh_members(user_id, updated, school_year, semester)
+
+    return section_ids
+
+
+def __content_version(section_ids: list) -> str:
+    """
+    用各个上课时间段的内容计算版本号，内容变化了版本号才会变化
+    :param section_ids:
+    :return:
+    """
+    return md5(b'|'.join(get_section_json(section_ids))).hexdigest()
+
+
+def __refresh_members(user_id: int, section_ids: set, school_year: int, semester: int) -> None:
+    """
+    上课时间段的内容被更新后，同一教学班其他同学缓存的版本号也要重新计算，
+    否则他们带着旧的 ETag 请求时得到 304，继续使用旧的课程表
+    :param user_id: 本次同步的用户，缓存由调用者写入
+    :param section_ids: 内容被更新的上课时间段
+    :param school_year:
+    :param semester:
     :return:
     """
-    class_schedule = []
+    member_ids = [row.user_id for row in db.session.query(ClassSchedule.user_id).filter(
+        ClassSchedule.school_year == school_year,
+        ClassSchedule.semester == semester,
+        ClassSchedule.section_id.in_(section_ids),
+        ClassSchedule.user_id != user_id
+    ).distinct()]
+
+    if not member_ids:
+        return
+
+    schedules = {}
+    for row in db.session.query(ClassSchedule.user_id, ClassSchedule.section_id).filter(
+            ClassSchedule.school_year == school_year,
+            ClassSchedule.semester == semester,
+            ClassSchedule.user_id.in_(member_ids)
+    ).order_by(ClassSchedule.id):
+        schedules.setdefault(row.user_id, []).append(row.section_id)
+
+    # 所有同学的上课时间段一次读出，与 __content_version 的计算方式一致
+    all_ids = list({section_id for member_sections in schedules.values() for section_id in member_sections})
+    json_map = dict(zip(all_ids, get_section_json(all_ids)))
+
+    with redis.batch() as pipe:
+        for member_id, member_sections in schedules.items():
+            schedule_cache.set(schedule_cache.key(school_year, semester, member_id), {
+                'sections': member_sections,
+                'version': md5(b'|'.join(json_map[section_id] for section_id in member_sections)).hexdigest()
+            }, pipe)
+
+
+def __save_sections(class_schedule_list: list, school_year: int, semester: int) -> list:
+    """
+    找到或创建课程表中各个上课时间段
+
+    先查 Redis 中的 (教学班, 时间段) -> id 索引，同班同学同步过的时间段直接命中；
+    没有命中的再查数据库，数据库也没有才插入。
+    教务系统的数据与已保存的不同时，以最新同步的为准
+
+    :param class_schedule_list:
+    :param school_year:
+    :param semester:
+    :return: 与课程表顺序一致的上课时间段 id, 需要写入的索引, 需要写入的 JSON, 占用情况有变化的教室,
+        内容被更新的上课时间段 id
+    """
+    sections = {}
     for course in class_schedule_list:
-        db.session.add(
-            ClassSchedule(
-                user_id=user_id,
-                school_year=school_year,
-                semester=semester,
-                subdivision_type=course['subdivision_type'],
-                course_name=course['course_name'],
-                course_id=course['course_id'],
-                credit=float(course['credit']),
-                teacher=dumps(course['teacher']),
-                classroom=course['classroom'],
-                weekday=course['weekday'],
-                start_node=course['start_node'],
-                end_node=course['end_node'],
-                start_week=course['start_week'],
-                end_week=course['end_week']
-            )
+        section = CourseSection(
+            school_year=school_year,
+            semester=semester,
+            course_id=course['course_id'],
+            weekday=int(course['weekday']),
+            start_node=int(course['start_node']),
+            end_node=int(course['end_node']),
+            start_week=int(course['start_week']),
+            end_week=int(course['end_week']),
+            subdivision_type=course['subdivision_type'],
+            course_name=course['course_name'],
+            credit=float(course['credit']),
+            teacher=dumps(course['teacher']),
+            classroom=course['classroom']
         )
+        sections.setdefault(section.get_key(), section)
 
-        class_schedule.append({
-            'courseId': course['course_id'],
-            'subdivisionType': course['subdivision_type'],
-            'courseName': course['course_name'],
-            'credit': float(course['credit']),
-            'teacher': course['teacher'],
-            'classroom': course['classroom'],
-            'weekday': course['weekday'],
-            'startNode': course['start_node'],
-            'endNode': course['end_node'],
-            'startWeek': course['start_week'],
-            'endWeek': course['end_week']
-        })
+    if not sections:
+        return [], {}, {}, set(), set()
 
-    db.session.commit()
-    return class_schedule
+    index_key = f'course-section-ids-{school_year}-{semester}'
+    fields = {key: '|'.join(str(item) for item in key) for key in sections}
+
+    section_ids = {}
+    for key, section_id in zip(sections, redis.hmget(index_key, list(fields.values()))):
+        if section_id is not None:
+            section_ids[key] = int(section_id)
+
+    # 索引命中的，用缓存的 JSON 判断内容是否变化
+    changed = set()
+    if section_ids:
+        cached = redis.mget([f'course-section-{section_id}' for section_id in section_ids.values()])
+        for key, fragment in zip(section_ids, cached):
+            if fragment is None or fragment.decode('utf-8') != sections[key].get_json():
+                changed.add(key)
+
+    # 索引没有命中的，或者内容可能变化的，与数据库对比
+    check = [key for key in sections if key not in section_ids or key in changed]
+    index, fragments, classrooms, updated = {}, {}, set(), set()
+    if check:
+        existing = {}
+        for section in query_course_sections(school_year, semester, {key[0] for key in check}):
+            existing[section.get_key()] = section
+
+        new_rows = [__to_row(sections[key]) for key in check if key not in existing]
+        classrooms.update(row['classroom'] for row in new_rows)
+        if new_rows:
+
+            # 同班同学可能同时同步，已存在的时间段忽略
+            bulk_insert(CourseSection, new_rows, ignore=True)
+
+            # 被忽略的行是其他事务在上面的查询之后才提交的，普通查询读的还是旧快照，
+            # 要用加锁读取才能看到最新提交的数据
+            for section in query_course_sections(
+                    school_year, semester, {row['course_id'] for row in new_rows}
+            ).with_for_update():
+                existing.setdefault(section.get_key(), section)
+
+        update_rows = []
+        for key in check:
+            section = existing[key]
+            section_ids[key] = section.id
+
+            if __is_changed(section, sections[key]):
+                update_rows.append({'id': section.id, **__to_row(sections[key])})
+                updated.add(section.id)
+                classrooms.update((section.classroom, sections[key].classroom))
+
+        bulk_update(CourseSection, update_rows)
+
+        for key in check:
+            index[fields[key]] = section_ids[key]
+            fragments[section_ids[key]] = sections[key].get_json()
+
+    return [section_ids[key] for key in sections], index, fragments, classrooms, updated
+
+
+def __is_changed(section, new_section) -> bool:
+    """
+    已保存的时间段与教务系统的数据是否不同
+    :param section:
+    :param new_section:
+    :return:
+    """
+    return section.subdivision_type != new_section.subdivision_type \
+        or section.course_name != new_section.course_name \
+        or section.credit != new_section.credit \
+        or section.classroom != new_section.classroom \
+        or loads(section.teacher) != loads(new_section.teacher)
+
+
+def __to_row(section) -> dict:
+    """
+    把上课时间段转换成数据库的字段
+    :param section:
+    :return:
+    """
+    return {
+        'school_year': section.school_year,
+        'semester': section.semester,
+        'course_id': section.course_id,
+        'weekday': section.weekday,
+        'start_node': section.start_node,
+        'end_node': section.end_node,
+        'start_week': section.start_week,
+        'end_week': section.end_week,
+        'subdivision_type': section.subdivision_type,
+        'course_name': section.course_name,
+        'credit': section.credit,
+        'teacher': section.teacher,
+        'classroom': section.classroom
+    }
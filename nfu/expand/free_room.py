@@ -0,0 +1,130 @@
+from sqlalchemy import exists
+
+from nfu.expand.schedule_index import MAX_WEEK, NODES, get_slot_mask
+from nfu.extensions import db, redis
+from nfu.models import ClassSchedule, CourseSection
+
+# 一周的节次数
+WEEK_SLOTS = 7 * NODES
+
+# 没有教室的课程
+NO_CLASSROOM = '未分配教室'
+
+
+def get_occupancy_mask(section) -> int:
+    """
+    上课时间段在整个学期的位图，第 w 周星期 d 第 n 节对应第 w * WEEK_SLOTS + (d - 1) * NODES + n - 1 位
+    :param section:
+    :return:
+    """
+    slot_mask = get_slot_mask(section.weekday, section.start_node, section.end_node)
+
+    mask = 0
+    for week in range(section.start_week, section.end_week + 1):
+        mask |= slot_mask << (week * WEEK_SLOTS)
+
+    return mask
+
+
+def mark_changed(school_year: int, semester: int, classrooms) -> None:
+    """
+    记录上课时间段有变化的教室，等定时任务 rooms-rebuild --changed 重建
+    :param school_year:
+    :param semester:
+    :param classrooms:
+    :return:
+    """
+    classrooms = {classroom for classroom in classrooms if classroom != NO_CLASSROOM}
+
+    if classrooms:
+        redis.sadd(f'classroom-changed-{school_year}-{semester}', *classrooms)
+
+
+def rebuild_occupancy(school_year: int, semester: int, classrooms=None) -> int:
+    """
+    根据数据库重建教室的占用位图
+
+    教务系统调课后旧的上课时间段仍留在表中，只是没有人再选，
+    只统计至少有一名同学选了的时间段，否则旧的教室会一直被占用
+
+    :param school_year:
+    :param semester:
+    :param classrooms: 需要重建的教室，为 None 时重建全部
+    :return: 重建的教室数
+    """
+    query = db.session.query(
+        CourseSection.classroom,
+        CourseSection.weekday,
+        CourseSection.start_node,
+        CourseSection.end_node,
+        CourseSection.start_week,
+        CourseSection.end_week
+    ).filter_by(school_year=school_year, semester=semester).filter(
+        CourseSection.classroom != NO_CLASSROOM,
+        exists().where(ClassSchedule.section_id == CourseSection.id)
+    )
+
+    if classrooms is not None:
+        classrooms = list(classrooms)
+        if not classrooms:
+            return 0
+
+        query = query.filter(CourseSection.classroom.in_(classrooms))
+
+    occupancy = dict.fromkeys(classrooms or [], 0)
+    for section in query:
+        occupancy[section.classroom] = occupancy.get(section.classroom, 0) | get_occupancy_mask(section)
+
+    key = f'classroom-occupancy-{school_year}-{semester}'
+    with redis.batch() as pipe:
+        if classrooms is None:
+            pipe.delete(key)
+
+        if occupancy:
+            pipe.hmset(key, {classroom: f'{mask:x}' for classroom, mask in occupancy.items()})
+
+    return len(occupancy)
+
+
+def rebuild_changed(school_year: int, semester: int, batch_size: int = 500) -> int:
+    """
+    重建有变化的教室
+    :param school_year:
+    :param semester:
+    :param batch_size: 每次取出的教室数
+    :return: 重建的教室数
+    """
+    count = 0
+    while True:
+        classrooms = redis.spop(f'classroom-changed-{school_year}-{semester}', batch_size)
+        if not classrooms:
+            return count
+
+        count += rebuild_occupancy(school_year, semester, {classroom.decode('utf-8') for classroom in classrooms})
+
+
+def get_free_rooms(school_year: int, semester: int, week: int, weekday: int, nodes: list) -> list:
+    """
+    查询指定时间没有课的教室
+    :param school_year:
+    :param semester:
+    :param week:
+    :param weekday:
+    :param nodes: 节次
+    :return: 空闲的教室，按名称排序，周次、星期、节次超出范围时为空
+    """
+    if not 1 <= week <= MAX_WEEK or not 1 <= weekday <= 7 or not all(1 <= node <= NODES for node in nodes):
+        return []
+
+    query_mask = 0
+    for node in nodes:
+        query_mask |= get_slot_mask(weekday, node, node)
+    query_mask <<= week * WEEK_SLOTS
+
+    occupancy = redis.hgetall(f'classroom-occupancy-{school_year}-{semester}')
+
+    return sorted(
+        classroom.decode('utf-8')
+        for classroom, mask in occupancy.items()
+        if not int(mask, 16) & query_mask
+    )
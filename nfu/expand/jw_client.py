@@ -0,0 +1,109 @@
+from os import getpid
+from random import uniform
+from time import monotonic, sleep
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from nfu.nfu_error import NFUError
+
+
+class JWClient:
+    """
+    教务系统 HTTP 客户端
+
+    每个 worker 进程持有一个 keep-alive 的连接池，
+    失败时按指数退避加随机抖动重试，并且每次调用都有总时限，
+    教务系统再慢也不会长时间占住 worker
+    """
+    base_url = 'http://ecampus.nfu.edu.cn:2929'
+
+    # 各接口的 (单次请求超时, 整次调用的总时限)，单位秒
+    timeouts = {
+        'login': (5, 15),
+        'myself': (5, 15),
+        'profile': (5, 15),
+        'class_schedule': (8, 25),
+        'achievement': (8, 25),
+        'total_achievement': (8, 25),
+    }
+
+    max_attempts = 6
+    backoff_base = 0.2
+    backoff_max = 3
+    pool_size = 16
+
+    # 视为可重试的错误：网络错误、返回数据格式不对
+    retry_errors = (OSError, LookupError, TypeError, ValueError)
+
+    def __init__(self, app=None):
+        self._session = None
+        self._pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """
+        读取配置，覆盖默认的超时与重试次数
+        :param app:
+        :return:
+        """
+        self.timeouts = {**self.timeouts, **app.config['JW_TIMEOUTS']}
+        self.max_attempts = app.config['JW_MAX_ATTEMPTS']
+
+    @property
+    def session(self) -> Session:
+        """
+        当前进程的 session，fork 出来的 worker 会各自新建一个
+        :return:
+        """
+        if self._session is None or self._pid != getpid():
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            self._session = session
+            self._pid = getpid()
+
+        return self._session
+
+    def post(self, endpoint: str, path: str, data: dict, error: str, parse):
+        """
+        发送 post 请求，并用 parse 处理返回的数据
+
+        parse 抛出 retry_errors 中的异常时重试，抛出 NFUError 则直接返回给调用者
+
+        :param endpoint: 接口名，对应 timeouts 中的时限
+        :param path: 接口路径
+        :param data: 请求的数据
+        :param error: 重试失败后的错误信息
+        :param parse: 处理 response 的函数
+        :return: parse 的返回值
+        """
+        timeout, budget = self.timeouts[endpoint]
+        deadline = monotonic() + budget
+
+        for attempt in range(self.max_attempts):
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                response = self.session.post(self.base_url + path, data=data, timeout=min(timeout, remaining))
+                return parse(response)
+            except self.retry_errors:
+                pass
+
+            # 指数退避，加上随机抖动避免大家同时重试
+            delay = uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            if monotonic() + delay >= deadline:
+                break
+
+            sleep(delay)
+
+        raise NFUError(error)
+
+
+jw_client = JWClient()
@@ -0,0 +1,39 @@
+from nfu.extensions import redis
+
+# 所有计数器存放在同一个 hash 中，各 worker 共用
+METRICS_KEY = 'metrics'
+
+
+def incr(name: str, amount: int = 1, pipe=None) -> None:
+    """
+    计数器加一
+    :param name: 计数器名称
+    :param amount:
+    :param pipe: 与其他命令一起发送时传入 pipeline
+    :return:
+    """
+    (pipe or redis).hincrby(METRICS_KEY, name, amount)
+
+
+def get_metrics(prefix: str = '') -> dict:
+    """
+    读取计数器
+    :param prefix: 只返回以此开头的计数器
+    :return: {名称: 数值}
+    """
+    return {
+        name.decode('utf-8'): int(value)
+        for name, value in redis.hgetall(METRICS_KEY).items()
+        if name.decode('utf-8').startswith(prefix)
+    }
+
+
+def reset_metrics(prefix: str = '') -> None:
+    """
+    清零计数器
+    :param prefix: 只清零以此开头的计数器
+    :return:
+    """
+    names = list(get_metrics(prefix))
+    if names:
+        redis.hdel(METRICS_KEY, *names)
@@ -0,0 +1,126 @@
+from datetime import datetime
+from pathlib import Path
+
+from sqlalchemy import text
+
+from nfu.expand.achievement import query_achievement, query_semester
+from nfu.expand.class_schedule import query_course_sections, query_schedule
+from nfu.extensions import db
+from nfu.models import Electric, TicketOrder
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / 'migrations'
+
+
+def get_migrations() -> list:
+    """
+    读取 migrations 目录下的迁移文件
+
+    文件名格式为 0001_description.sql，前面的数字即为版本号
+
+    :return: [(版本号, 名称, 文件路径)]
+    """
+    migrations = []
+    for path in sorted(MIGRATIONS_DIR.glob('*.sql')):
+        migrations.append((int(path.stem.split('_', 1)[0]), path.stem, path))
+
+    return migrations
+
+
+def get_applied_versions() -> set:
+    """
+    获取已执行的版本号
+    :return:
+    """
+    db.session.execute(text(
+        'create table if not exists schema_version ('
+        'version int unsigned not null primary key, '
+        'name varchar(100) not null, '
+        'applied_at datetime not null)'
+    ))
+
+    return {row[0] for row in db.session.execute(text('select version from schema_version'))}
+
+
+def upgrade() -> list:
+    """
+    按版本号顺序执行尚未执行的迁移
+    :return: 本次执行的迁移名称
+    """
+    applied = get_applied_versions()
+    result = []
+
+    for version, name, path in get_migrations():
+        if version in applied:
+            continue
+
+        for statement in __split_statements(path.read_text(encoding='utf-8')):
+            db.session.execute(text(statement))
+
+        db.session.execute(
+            text('insert into schema_version (version, name, applied_at) values (:version, :name, :applied_at)'),
+            {'version': version, 'name': name, 'applied_at': datetime.now()}
+        )
+        db.session.commit()
+        result.append(name)
+
+    return result
+
+
+def get_hot_queries() -> dict:
+    """
+    各接口的热点查询
+
+    成绩与课表直接使用加载数据时的查询，排序条件也一致；
+    电费与车票的查询写在蓝本中，这里与蓝本保持一致，first() 即 limit(1)
+
+    :return:
+    """
+    return {
+        '/achievement/get': query_achievement(0),
+        '/achievement/update': query_semester(0, 2020, 1),
+        '/class-schedule/get': query_schedule(0, 2020, 1),
+        '/class-schedule/update': query_course_sections(2020, 1, ['2020-2021-1-00000']),
+        '/electric/get': Electric.query.filter_by(room_id=0).order_by(Electric.date.desc()).limit(1),
+        '/electric/analyse': Electric.query.filter_by(room_id=0).order_by(Electric.date.desc()).limit(15),
+        '/school-bus-pro/order/create/accelerate': TicketOrder.query.filter_by(
+            user_id=0,
+            ticket_date='2020-01-01',
+            bus_ids=0
+        ).limit(1)
+    }
+
+
+def explain_hot_queries() -> list:
+    """
+    对热点查询执行 EXPLAIN，找出全表扫描或需要额外排序的查询
+
+    :return: [(接口, 表, 问题)]，为空表示全部走索引
+    """
+    problems = []
+
+    for name, query in get_hot_queries().items():
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+
+        for row in db.session.execute(text(f'explain {sql}')):
+            extra = row['Extra'] or ''
+
+            # 表为空或条件不可能成立时，MySQL 不会选择索引，这不算问题
+            if 'no matching row' in extra or 'Impossible WHERE' in extra:
+                continue
+
+            if row['type'] == 'ALL' or row['key'] is None:
+                problems.append((name, row['table'], '全表扫描'))
+            elif 'Using filesort' in extra:
+                problems.append((name, row['table'], '额外排序'))
+
+    return problems
+
+
+def __split_statements(sql: str) -> list:
+    """
+    按分号拆分 sql 文件，并去掉注释
+    :param sql:
+    :return:
+    """
+    lines = [line for line in sql.splitlines() if not line.strip().startswith('--')]
+    return [statement.strip() for statement in '\n'.join(lines).split(';') if statement.strip()]
@@ -1,35 +1,38 @@
 from json import decoder, loads
+from time import time
 
-from requests import post
+from redis.exceptions import LockError
 
 from nfu.common import safe_base64_decode
-from nfu.nfu_error import NFUError
+from nfu.expand.jw_client import jw_client
+from nfu.extensions import redis
+from nfu.nfu_error import JWTokenRejected, NFUError
 
+# 令牌在 JWT 过期前多少秒就不再使用
+TOKEN_EXPIRE_MARGIN = 120
 
-def get_jw_token(student_id: int, password: str = '', count: int = 0) -> str:
+# 同一学生同时只允许一个登录请求，其余请求等待其结果
+TOKEN_LOCK_TIMEOUT = 70
+
+
+def __login(student_id: int, password: str) -> str:
     """
-    登陆教务系统
-    :param count:
+    登陆教务系统，不经过缓存
     :param student_id: 学号
-    :param password: 密码，默认为空字符串
+    :param password: 密码
     :return token:
     """
 
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-privilegei/User/r-login'
     data = {
         'username': student_id,
         'password': password,
         'rd': ''
     }
 
-    try:
-        response = post(url, data=data, timeout=10)
-        token = loads(response.text)['msg']
-    except (OSError, decoder.JSONDecodeError):
-        if count >= 5:
-            raise NFUError('教务系统登录接口错误，请稍后再试')
-        else:
-            return get_jw_token(student_id, password, count + 1)
+    def parse(response):
+        return loads(response.text)['msg']
+
+    token = jw_client.post('login', '/jw-privilegei/User/r-login', data, '教务系统登录接口错误，请稍后再试', parse)
 
     if not token:
         raise NFUError('学号或密码错误!')
@@ -37,58 +40,172 @@ def get_jw_token(student_id: int, password: str = '', count: int = 0) -> str:
     return token
 
 
+def get_jw_token(student_id: int, password: str = '') -> str:
+    """
+    获取教务系统的令牌
+
+    令牌按学号缓存在 Redis，直到 JWT 快过期为止；
+    缓存失效时，同一学号的并发请求只会有一个真正去登录，其余等待它写入的缓存
+
+    :param student_id: 学号
+    :param password: 密码，默认为空字符串
+    :return token:
+    """
+    token = redis.get(f'jw-token-{student_id}')
+    if token is not None:
+        return token.decode('utf-8')
+
+    try:
+        with redis.lock(f'jw-token-lock-{student_id}', timeout=TOKEN_LOCK_TIMEOUT, blocking_timeout=TOKEN_LOCK_TIMEOUT):
+
+            # 等锁期间，其他请求可能已经登录过了
+            token = redis.get(f'jw-token-{student_id}')
+            if token is not None:
+                return token.decode('utf-8')
+
+            token = __login(student_id, password)
+            __cache_token(student_id, token)
+
+    except LockError:
+        # 等不到锁就自己登录，不影响正常使用
+        token = __login(student_id, password)
+
+    return token
+
+
+def invalidate_jw_token(student_id: int, token: str) -> None:
+    """
+    作废缓存的令牌，若缓存已被其他请求换成新令牌，则不做处理
+    :param student_id:
+    :param token: 被教务系统拒绝的令牌
+    :return:
+    """
+    cache = redis.get(f'jw-token-{student_id}')
+    if cache is not None and cache.decode('utf-8') == token:
+        redis.delete(f'jw-token-{student_id}')
+
+
+def call_with_jw_token(student_id: int, password: str, func, *args):
+    """
+    携带缓存的令牌调用教务系统接口
+
+    若令牌被教务系统拒绝，则作废缓存并重新登录，再调用一次
+
+    :param student_id: 学号
+    :param password: 密码
+    :param func: 第一个参数为令牌的函数
+    :param args: 其余参数
+    :return: func 的返回值
+    """
+    token = get_jw_token(student_id, password)
+
+    try:
+        return func(token, *args)
+    except JWTokenRejected:
+        invalidate_jw_token(student_id, token)
+
+    return func(get_jw_token(student_id, password), *args)
+
+
+def __cache_token(student_id: int, token: str) -> None:
+    """
+    按 JWT 的过期时间缓存令牌
+    :param student_id:
+    :param token:
+    :return:
+    """
+    try:
+        expire = int(__get_token_payload(token)['exp'] - time()) - TOKEN_EXPIRE_MARGIN
+    except (IndexError, KeyError, TypeError, ValueError):
+        return
+
+    if expire > 0:
+        redis.set(f'jw-token-{student_id}', token, ex=expire)
+
+
+def __get_token_payload(token: str) -> dict:
+    """
+    解析 JWT 的 payload
+    :param token:
+    :return:
+    """
+    token_data_base64 = token.split('.')[1]
+    return loads(safe_base64_decode(token_data_base64))
+
+
+def __check_token(response) -> None:
+    """
+    判断教务系统是否拒绝了令牌
+    :param response:
+    :return:
+    """
+    if response.status_code in (401, 403):
+        raise JWTokenRejected()
+
+    try:
+        message = loads(response.text)['msg']
+    except (KeyError, TypeError, decoder.JSONDecodeError):
+        return
+
+    __check_message(message)
+
+
+def __check_message(message) -> None:
+    """
+    根据返回的 msg 判断令牌是否被拒绝
+    :param message:
+    :return:
+    """
+    if isinstance(message, str) and ('登录' in message or 'token' in message.lower()):
+        raise JWTokenRejected()
+
+
 def get_actual_id(token: str) -> str:
     """
     获取 actual_id
     :param token:
     :return:
     """
-    token_data_base64 = token.split('.')[1]
-    token_data = loads(safe_base64_decode(token_data_base64))
-    auth_data = loads(token_data['aud'])
+    auth_data = loads(__get_token_payload(token)['aud'])
 
     return auth_data['actualId']
 
 
-def get_student_data(token: str, count: int = 0) -> dict:
+def get_student_data(token: str) -> dict:
     """
     获取学生信息
     :param token:
-    :param count:
     :return:
     """
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-privilegei/User/r-getMyself'
     data = {'jwloginToken': token}
 
-    try:
-        response = post(url, data=data, timeout=10)
-        data = loads(response.text)['msg']
-
-    except (OSError, KeyError, decoder.JSONDecodeError):
-        if count >= 5:
-            raise NFUError('教务系统专业接口繁忙')
-        return get_student_data(token, count + 1)
+    def parse(response):
+        __check_token(response)
+        return loads(response.text)['msg']
 
-    return data
+    return jw_client.post('myself', '/jw-privilegei/User/r-getMyself', data, '教务系统专业接口繁忙', parse)
 
 
-def get_profile(student_id: int, token: str, count: int = 0):
+def get_profile(token: str, student_id: int):
     grade = int(f'20{str(student_id)[:2]}')
     student_data = get_student_data(token)
 
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-srsi/SrsFjflStudent/r-getZyfxRecByJbzlId'
     data = {
         'id': student_data['actualId'],
         'jwloginToken': token
     }
 
-    try:
-        response = post(url, data=data, timeout=10)
-        data = loads(response.text)
-    except (OSError, decoder.JSONDecodeError):
-        if count >= 5:
-            raise NFUError('教务系统专业接口繁忙')
-        return get_profile(student_id, token, count + 1)
+    def parse(response):
+        __check_token(response)
+        return loads(response.text)
+
+    data = jw_client.post(
+        'profile',
+        '/jw-srsi/SrsFjflStudent/r-getZyfxRecByJbzlId',
+        data,
+        '教务系统专业接口繁忙',
+        parse
+    )
 
     try:
         profile = data['msg']
@@ -124,15 +241,14 @@ def get_student_name(student_id: int, password: str) -> str:
     :return name:
     """
 
-    token = get_jw_token(student_id, password)
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-privilegei/User/r-getMyself'
+    # 注册时需要校验密码，所以不能使用缓存的令牌
+    token = __login(student_id, password)
     data = {'jwloginToken': token}
 
-    try:
-        response = post(url, data=data, timeout=10)
-        name = loads(response.text)['msg']['name']
-    except (OSError, KeyError):
-        raise NFUError('实名验证错误，请稍后再试')
+    def parse(response):
+        return loads(response.text)['msg']['name']
+
+    name = jw_client.post('myself', '/jw-privilegei/User/r-getMyself', data, '实名验证错误，请稍后再试', parse)
 
     if not name:
         raise NFUError('没有获取到数据，请稍后再试')
@@ -140,39 +256,86 @@ def get_student_name(student_id: int, password: str) -> str:
     return name
 
 
-def get_class_schedule(token: str, school_year: int, semester: int, count: int = 0) -> list:
+def get_class_schedule_raw(token: str, school_year: int, semester: int) -> bytes:
     """
-    向教务系统请求课程表数据
+    向教务系统请求课程表的原始数据，不做解析
+
+    令牌失效或教务系统出错时返回的数据很短，只有这时才解析校验，
+    正常的课程表原样返回，由调用者先比较摘要再决定是否解析
 
-    :param count:
     :param token:
     :param school_year:
     :param semester:
     :return:
     """
-    course_data = []
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-cssi/CssStudent/r-listJxb'
     data = {
         'xn': school_year,
         'xq': semester,
         'jwloginToken': token
     }
 
-    try:
-        response = post(url, data=data, timeout=10)
-        course_list = loads(response.text)['msg']
-    except (OSError, KeyError, decoder.JSONDecodeError):
-        if count >= 5:
-            raise NFUError('教务系统课程表接口错误，请稍后再试')
-        else:
-            return get_class_schedule(token, school_year, semester, count + 1)
+    def parse(response):
+        if response.status_code != 200:
+            __check_token(response)
+            raise ValueError(response.status_code)
+
+        if len(response.content) < 512:
+            parse_class_schedule(response.content)
+
+        return response.content
+
+    return jw_client.post(
+        'class_schedule',
+        '/jw-cssi/CssStudent/r-listJxb',
+        data,
+        '教务系统课程表接口错误，请稍后再试',
+        parse
+    )
+
+
+def get_class_schedule(token: str, school_year: int, semester: int) -> tuple:
+    """
+    向教务系统请求课程表数据
+
+    :param token:
+    :param school_year:
+    :param semester:
+    :return: 原始数据, 课程表
+    """
+    data = {
+        'xn': school_year,
+        'xq': semester,
+        'jwloginToken': token
+    }
+
+    def parse(response):
+        if response.status_code in (401, 403):
+            raise JWTokenRejected()
+
+        return response.content, parse_class_schedule(response.content)
+
+    return jw_client.post(
+        'class_schedule',
+        '/jw-cssi/CssStudent/r-listJxb',
+        data,
+        '教务系统课程表接口错误，请稍后再试',
+        parse
+    )
+
+
+def parse_class_schedule(raw: bytes) -> list:
+    """
+    解析教务系统返回的课程表
+    :param raw: 原始数据
+    :return:
+    """
+    course_data = []
+    course_list = loads(raw)['msg']
+    __check_message(course_list)
 
     # 判断获取的数据是否是列表，如果不是列表，可能教务系统又炸了
     if not isinstance(course_list, list):
-        if count >= 5:
-            raise NFUError('教务系统错误，请稍后再试')
-        else:
-            return get_class_schedule(token, school_year, semester, count + 1)
+        raise TypeError(course_list)
 
     for course in course_list:  # 循环所有课程
         for merge in course['kbMergeList']:  # 课程可能有不同上课时间，循环取出
@@ -214,17 +377,15 @@ def get_class_schedule(token: str, school_year: int, semester: int, count: int =
     return course_data
 
 
-def get_achievement_list(token: str, school_year: int, semester: int, count: int = 0) -> list:
+def get_achievement_list(token: str, school_year: int, semester: int) -> list:
     """
     获取成绩单
-    :param count:
     :param token:
     :param school_year:
     :param semester:
     :return:
     """
 
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-amsi/AmsJxbXsZgcj/r-list'
     data = {
         'deleted': False,
         'pg': 1,
@@ -234,39 +395,33 @@ def get_achievement_list(token: str, school_year: int, semester: int, count: int
         'jwloginToken': token
     }
 
-    try:
-        response = post(url, data=data, timeout=10)
-    except OSError:
-        if count >= 5:
-            raise NFUError('教务系统成绩接口错误，请稍后再试')
-        else:
-            return get_achievement_list(token, school_year, semester, count + 1)
+    def parse(response):
+        __check_token(response)
+        return loads(response.text)['msg']
 
-    try:
-        course = loads(response.text)['msg']
-    except (KeyError, decoder.JSONDecodeError):
-        if count >= 5:
-            raise NFUError('教务系统错误，请稍后再试')
-        else:
-            return get_achievement_list(token, school_year, semester, count + 1)
+    course = jw_client.post(
+        'achievement',
+        '/jw-amsi/AmsJxbXsZgcj/r-list',
+        data,
+        '教务系统成绩接口错误，请稍后再试',
+        parse
+    )
 
     try:
         course = course['list']
-    except KeyError:
+    except (KeyError, TypeError):
         raise NFUError(course)
 
     return course
 
 
-def get_total_achievement_point(token: str, count: int = 0) -> dict:
+def get_total_achievement_point(token: str) -> dict:
     """
     获取学分、成绩的总体情况
-    :param count:
     :param token:
     :return:
     """
 
-    url = 'http://ecampus.nfu.edu.cn:2929/jw-amsi/AmsJxbXsZgcj/listXs'
     data = {
         'deleted': False,
         'pageSize': 65535,
@@ -274,22 +429,38 @@ def get_total_achievement_point(token: str, count: int = 0) -> dict:
         'jwloginToken': token
     }
 
-    try:
-        response = post(url, data=data, timeout=10)
-        data = loads(response.text)['msg']['list'][0]
-    except (OSError, KeyError, decoder.JSONDecodeError):
-        if count >= 5:
-            raise NFUError('教务系统绩点接口错误，请稍后再试')
-        return get_total_achievement_point(token, count + 1)
-
-    if not data:
-        if count >= 5:
-            raise NFUError('没有获取到数据，请稍后再试')
-        return get_total_achievement_point(token, count + 1)
+    def parse(response):
+        __check_token(response)
+        total = loads(response.text)['msg']['list'][0]
+
+        if not total:
+            raise ValueError(total)
+
+        return total
+
+    data = jw_client.post(
+        'total_achievement',
+        '/jw-amsi/AmsJxbXsZgcj/listXs',
+        data,
+        '教务系统绩点接口错误，请稍后再试',
+        parse
+    )
 
     return {
         'selected_credit': data['yxxf'],
         'get_credit': data['yhdxf'],
         'average_achievement': data['avg'],
-        'average_achievement_point': data['avgJd']
+        'average_achievement_point': __to_float(data.get('avgJd'))
     }
+
+
+def __to_float(value):
+    """
+    教务系统的数值可能是字符串，成绩公布前可能为空
+    :param value:
+    :return: 为空或无法解析时返回 None
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
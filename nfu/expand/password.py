@@ -0,0 +1,150 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from multiprocessing import get_context
+from os import getpid
+from threading import Lock
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+from nfu.expand.metrics import incr
+from nfu.extensions import db
+from nfu.nfu_error import NFUError
+
+
+class PasswordHasher:
+    """
+    密码哈希
+
+    计算哈希很耗 CPU，放在 worker 的 gevent 循环里做会卡住这个 worker 的所有请求，
+    所以交给一个进程池计算，当前请求只是等待结果。
+    进程池排队的任务超过上限时直接返回繁忙，不让开学时的登录高峰拖垮所有 worker
+    """
+
+    def __init__(self, app=None):
+        self._executor = None
+        self._pid = None
+        self._pending = 0
+        self._pending_lock = Lock()
+
+        self.method = 'pbkdf2:sha256:150000'
+        self.pool_size = 2
+        self.queue_limit = 32
+        self.timeout = 10
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """
+        读取配置
+        :param app:
+        :return:
+        """
+        self.method = self.normalize_method(app.config['PASSWORD_HASH_METHOD'])
+        self.pool_size = app.config['PASSWORD_POOL_SIZE']
+        self.queue_limit = app.config['PASSWORD_QUEUE_LIMIT']
+        self.timeout = app.config['PASSWORD_TIMEOUT']
+
+    @property
+    def executor(self):
+        """
+        当前进程的进程池，fork 出来的 worker 会各自新建一个
+
+        使用 forkserver 启动计算进程，不从已打过 gevent 补丁的 worker 直接 fork
+        :return: pool_size 为 0 时返回 None，在当前进程计算
+        """
+        if self.pool_size <= 0:
+            return None
+
+        if self._executor is None or self._pid != getpid():
+            self._executor = ProcessPoolExecutor(self.pool_size, mp_context=get_context('forkserver'))
+            self._pid = getpid()
+            self._pending = 0
+            self._pending_lock = Lock()
+
+        return self._executor
+
+    def hash(self, password: str) -> str:
+        """
+        按当前配置的算法计算哈希
+        :param password:
+        :return:
+        """
+        return self.__run(generate_password_hash, password, self.method)
+
+    def verify(self, user, password: str) -> bool:
+        """
+        验证密码，通过后若数据库中的哈希不是当前配置的算法，顺便升级
+        :param user: 数据库中的用户
+        :param password:
+        :return:
+        """
+        if not self.__run(check_password_hash, user.password, password):
+            return False
+
+        if self.needs_rehash(user.password):
+            user.password = self.hash(password)
+            db.session.add(user)
+            db.session.commit()
+            incr('password-rehash')
+
+        return True
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """
+        哈希的算法与参数是否与当前配置不同
+        :param pwhash:
+        :return:
+        """
+        return pwhash.split('$', 1)[0] != self.method
+
+    @staticmethod
+    def normalize_method(method: str) -> str:
+        """
+        补全算法参数，与 werkzeug 写入哈希的前缀一致，
+        如 pbkdf2:sha256 写入的是 pbkdf2:sha256:150000，不补全的话每次登录都会被当作需要升级
+        :param method:
+        :return:
+        """
+        if not method.startswith('pbkdf2:'):
+            return method
+
+        args = method[7:].split(':')
+        iterations = len(args) > 1 and int(args[1] or 0) or DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{args[0]}:{iterations}'
+
+    def __run(self, func, *args):
+        """
+        在进程池中执行，等待结果
+        :param func:
+        :param args:
+        :return:
+        """
+        executor = self.executor
+        if executor is None:
+            return func(*args)
+
+        with self._pending_lock:
+            if self._pending >= self.queue_limit:
+                incr('password-rejected')
+                raise NFUError('登录人数过多，请稍后再试')
+
+            self._pending += 1
+
+        # 等待超时后任务仍在进程池中运行，算完才能从排队数中减掉
+        future = executor.submit(func, *args)
+        future.add_done_callback(self.__done)
+
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+
+            # 还没开始计算的直接取消
+            future.cancel()
+            raise NFUError('登录人数过多，请稍后再试')
+
+    def __done(self, _) -> None:
+        with self._pending_lock:
+            self._pending -= 1
+
+
+password_hasher = PasswordHasher()
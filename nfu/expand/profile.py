@@ -0,0 +1,53 @@
+from nfu.expand.cache import ReadThroughCache
+from nfu.expand.nfu import call_with_jw_token, get_profile
+from nfu.expand.rank import update_rank
+from nfu.expand.reference import reference
+from nfu.extensions import db
+from nfu.models import Profile, TotalAchievements
+
+profile_cache = ReadThroughCache('profile-cache', ttl=7 * 86400, stale_ttl=30 * 86400)
+
+
+def get_profile_data(user) -> dict:
+    """
+    获取学生个人信息，依次查缓存、数据库、教务系统
+    :param user: 有 id 和 jw_pwd 的用户，需要访问教务系统时才读取 jw_pwd
+    :return:
+    """
+    return profile_cache.get(profile_cache.key(user.id), lambda: __load(user))
+
+
+def __load(user) -> dict:
+    """
+    从数据库读取个人信息，没有则向教务系统获取并写入数据库
+    :param user:
+    :return:
+    """
+    user_id = user.id
+    profile = Profile.query.get(user_id)
+
+    if profile is None:
+        profile_data = call_with_jw_token(user_id, user.jw_pwd, get_profile, user_id)
+
+        profile = Profile(
+            user_id=user_id,
+            grade=profile_data['grade'],
+            college_id=profile_data['college_id'],
+            profession_id=profile_data['profession_id'],
+            direction=profile_data['direction']
+        )
+
+        db.session.add(profile)
+        db.session.commit()
+
+        # 已有总体成绩的同学，有了档案后加入排名
+        total_achievement = TotalAchievements.query.get(user_id)
+        if total_achievement is not None:
+            update_rank(user_id, total_achievement.average_achievement_point, profile)
+
+    return {
+        'grade': profile.grade,
+        'college': reference.get_college(profile.college_id),
+        'profession': reference.get_profession(profile.profession_id),
+        'direction': profile.direction
+    }
@@ -0,0 +1,117 @@
+from nfu.extensions import db, redis
+from nfu.models import Profile, TotalAchievements
+from nfu.nfu_error import NFUError
+
+
+def __rank_keys(profile) -> dict:
+    """
+    学生所在的排名集合，同年级同专业、同年级同学院
+    :param profile:
+    :return:
+    """
+    return {
+        'profession': f'rank-profession-{profile.grade}-{profile.profession_id}',
+        'college': f'rank-college-{profile.grade}-{profile.college_id}'
+    }
+
+
+def update_rank(user_id: int, average_achievement_point: float, profile=None) -> None:
+    """
+    更新学生在排名集合中的平均绩点
+    :param user_id:
+    :param average_achievement_point: 为 None 时（还没有绩点）移出排名
+    :param profile: 个人档案，不传则从数据库读取
+    :return:
+    """
+    if profile is None:
+        profile = Profile.query.get(user_id)
+
+    # 还没有个人档案，等获取档案时再加入排名
+    if profile is None:
+        return
+
+    with redis.batch() as pipe:
+        for key in __rank_keys(profile).values():
+            if average_achievement_point is None:
+                pipe.zrem(key, user_id)
+            else:
+                pipe.zadd(key, {user_id: average_achievement_point})
+
+
+def get_rank(user_id: int) -> dict:
+    """
+    获取学生在同年级同专业、同年级同学院中的排名
+
+    排名为绩点严格高于自己的人数加一，绩点相同的同学名次相同；
+    percentile 为绩点低于自己的同学所占的百分比
+
+    :param user_id:
+    :return:
+    """
+    profile = Profile.query.get(user_id)
+    if profile is None:
+        raise NFUError('请先获取个人信息')
+
+    keys = __rank_keys(profile)
+
+    pipe = redis.pipeline()
+    for key in keys.values():
+        pipe.zscore(key, user_id)
+        pipe.zcard(key)
+    result = pipe.execute()
+
+    scores = dict(zip(keys, result[0::2]))
+    totals = dict(zip(keys, result[1::2]))
+
+    if None in scores.values():
+        raise NFUError('请先获取总体成绩')
+
+    # 绩点严格高于、严格低于自己的人数
+    pipe = redis.pipeline()
+    for name, key in keys.items():
+        pipe.zcount(key, f'({scores[name]}', '+inf')
+        pipe.zcount(key, '-inf', f'({scores[name]}')
+    result = pipe.execute()
+
+    higher = dict(zip(keys, result[0::2]))
+    lower = dict(zip(keys, result[1::2]))
+
+    rank = {}
+    for name in keys:
+        rank[name] = {
+            'rank': higher[name] + 1,
+            'total': totals[name],
+            'percentile': round(lower[name] / totals[name] * 100, 2),
+            'averageAchievementPoint': scores[name]
+        }
+
+    return rank
+
+
+def rebuild_rank(batch_size: int = 1000) -> int:
+    """
+    根据数据库重建所有排名集合
+    :param batch_size: 每批写入的人数
+    :return: 写入的人数
+    """
+    query = db.session.query(Profile, TotalAchievements.average_achievement_point).join(
+        TotalAchievements,
+        TotalAchievements.user_id == Profile.user_id
+    ).filter(TotalAchievements.average_achievement_point.isnot(None)).order_by(Profile.user_id)
+
+    count = 0
+    last_id = 0
+    while True:
+        rows = query.filter(Profile.user_id > last_id).limit(batch_size).all()
+        if not rows:
+            break
+
+        with redis.batch() as pipe:
+            for profile, average_achievement_point in rows:
+                for key in __rank_keys(profile).values():
+                    pipe.zadd(key, {profile.user_id: average_achievement_point})
+
+        count += len(rows)
+        last_id = rows[-1][0].user_id
+
+    return count
@@ -0,0 +1,85 @@
+from time import time
+from uuid import uuid4
+
+from flask import current_app
+
+from nfu.expand.metrics import METRICS_KEY
+from nfu.extensions import redis
+
+# 滑动窗口限流，检查与计数在一个脚本中完成，多个 worker 同时请求也不会超过上限
+#
+# KEYS: 各个维度的计数 key，最后一个是计数器的 hash
+# ARGV: 当前时间 (毫秒), 本次请求的成员, 计数器前缀, 之后每个维度依次为 上限, 窗口 (毫秒)
+# 返回: 0 表示放行，否则为需要等待的毫秒数
+SLIDING_WINDOW = """
+local now = tonumber(ARGV[1])
+local n = #KEYS - 1
+local wait = 0
+
+for i = 1, n do
+    local limit = tonumber(ARGV[2 + i * 2])
+    local window = tonumber(ARGV[3 + i * 2])
+
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now - window)
+    if redis.call('ZCARD', KEYS[i]) >= limit then
+        local oldest = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+        local key_wait = window
+        if oldest[2] then
+            key_wait = tonumber(oldest[2]) + window - now
+        end
+        wait = math.max(wait, key_wait)
+    end
+end
+
+if wait > 0 then
+    redis.call('HINCRBY', KEYS[n + 1], ARGV[3] .. '-rejected', 1)
+    return wait
+end
+
+for i = 1, n do
+    redis.call('ZADD', KEYS[i], now, ARGV[2])
+    redis.call('PEXPIRE', KEYS[i], ARGV[3 + i * 2])
+end
+
+redis.call('HINCRBY', KEYS[n + 1], ARGV[3] .. '-allowed', 1)
+return 0
+"""
+
+__script = None
+
+
+def hit(name: str, identities: dict) -> float:
+    """
+    记录一次请求，并判断是否超过限制
+
+    各维度的 (上限, 窗口秒数) 在 RATE_LIMITS[name] 中配置，
+    任一维度超过上限时拒绝，被拒绝的请求不计入窗口
+
+    :param name: 限流规则名
+    :param identities: {维度: 标识}，如 {'user': 学号, 'ip': IP}，标识为 None 的维度不检查
+    :return: 放行时为 0，否则为需要等待的秒数
+    """
+    global __script
+
+    limits = current_app.config['RATE_LIMITS'].get(name, {})
+
+    keys, args = [], []
+    for dimension, identity in identities.items():
+        if identity is None or dimension not in limits:
+            continue
+
+        limit, window = limits[dimension]
+        keys.append(f'rate-limit-{name}-{dimension}-{identity}')
+        args.extend((limit, window * 1000))
+
+    if not keys:
+        return 0
+
+    if __script is None:
+        __script = redis.register_script(SLIDING_WINDOW)
+
+    wait = __script(
+        keys=[*keys, METRICS_KEY],
+        args=[int(time() * 1000), uuid4().hex, f'rate-limit-{name}', *args]
+    )
+    return int(wait) / 1000
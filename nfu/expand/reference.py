@@ -0,0 +1,139 @@
+from array import array
+from bisect import bisect_left
+from hashlib import md5
+from json import dumps
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from nfu.extensions import db
+from nfu.models import College, Dormitory, Profession
+
+
+class ReferenceData:
+    """
+    宿舍、学院、专业等静态数据
+
+    启动时一次读入内存，之后不再查询数据库，表中数据有变化需重启服务。
+    宿舍按 id 排序存放在几个 array 中，整张表只有几十个 Python 对象，
+    gunicorn 使用 --preload 时，各 worker 共享 fork 之前加载的内存页
+    """
+
+    def __init__(self, app=None):
+        self._loaded = False
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """
+        启动时加载
+        :param app:
+        :return:
+        """
+        if not app.config['REFERENCE_PRELOAD']:
+            return
+
+        with app.app_context():
+            try:
+                self.load()
+
+            # 数据库还没有初始化，例如首次执行迁移时，等第一次使用再加载
+            except SQLAlchemyError:
+                db.session.rollback()
+
+            # 使用 --preload 时这里在 master 进程执行，连接池中的连接会被 fork 出的 worker 继承，
+            # 多个 worker 共用一个 socket 会打乱 MySQL 协议，关闭后让每个 worker 自己建立连接
+            finally:
+                db.session.remove()
+                db.engine.dispose()
+
+    def load(self) -> None:
+        """
+        从数据库读取全部静态数据
+        :return:
+        """
+        buildings, floors = [], []
+        building_index, floor_index = {}, {}
+        ids, building_ids, floor_ids, rooms = array('I'), array('H'), array('H'), array('I')
+
+        # 选宿舍时的 楼栋 -> 楼层 -> 房间
+        tree = {}
+
+        for dormitory in db.session.query(
+                Dormitory.id, Dormitory.building, Dormitory.floor, Dormitory.room
+        ).order_by(Dormitory.id):
+            if dormitory.building not in building_index:
+                building_index[dormitory.building] = len(buildings)
+                buildings.append(dormitory.building)
+
+            if dormitory.floor not in floor_index:
+                floor_index[dormitory.floor] = len(floors)
+                floors.append(dormitory.floor)
+
+            ids.append(dormitory.id)
+            building_ids.append(building_index[dormitory.building])
+            floor_ids.append(floor_index[dormitory.floor])
+            rooms.append(dormitory.room)
+
+            tree.setdefault(dormitory.building, {}).setdefault(dormitory.floor, []).append({
+                'roomId': dormitory.id,
+                'room': dormitory.room
+            })
+
+        payload = dumps({'code': '1000', 'message': [{
+            'building': building,
+            'floors': [{'floor': floor, 'rooms': room_list} for floor, room_list in floor_tree.items()]
+        } for building, floor_tree in tree.items()]}, ensure_ascii=False).encode('utf-8')
+
+        self._buildings, self._floors = tuple(buildings), tuple(floors)
+        self._ids, self._building_ids, self._floor_ids, self._rooms = ids, building_ids, floor_ids, rooms
+        self._colleges = dict(db.session.query(College.id, College.college))
+        self._professions = dict(db.session.query(Profession.id, Profession.profession))
+        self._dormitory_tree = (payload, md5(payload).hexdigest())
+        self._loaded = True
+
+    def get_dormitory(self, room_id: int):
+        """
+        查询宿舍
+        :param room_id:
+        :return: (楼栋, 楼层, 房间号)，宿舍不存在时返回 None
+        """
+        self.__ensure_loaded()
+
+        i = bisect_left(self._ids, room_id)
+        if i == len(self._ids) or self._ids[i] != room_id:
+            return None
+
+        return self._buildings[self._building_ids[i]], self._floors[self._floor_ids[i]], self._rooms[i]
+
+    def get_dormitory_name(self, room_id: int) -> str:
+        """
+        宿舍的完整名称，如 "西学楼6号 1楼 101"
+        :param room_id:
+        :return: 宿舍不存在时返回空字符串
+        """
+        dormitory = self.get_dormitory(room_id)
+        return '' if dormitory is None else ' '.join(str(item) for item in dormitory)
+
+    def get_college(self, college_id: int):
+        self.__ensure_loaded()
+        return self._colleges.get(college_id)
+
+    def get_profession(self, profession_id: int):
+        self.__ensure_loaded()
+        return self._professions.get(profession_id)
+
+    def get_dormitory_tree(self) -> tuple:
+        """
+        选宿舍用的 楼栋 -> 楼层 -> 房间，已序列化成 JSON
+        :return: JSON, ETag
+        """
+        self.__ensure_loaded()
+        return self._dormitory_tree
+
+    def __ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+
+reference = ReferenceData()
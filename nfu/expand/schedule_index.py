@@ -0,0 +1,140 @@
+from datetime import date, datetime
+
+from nfu.extensions import redis
+from nfu.models import CourseSection
+
+# 每天最多的节数
+NODES = 16
+
+# 一天所有节次的掩码
+DAY_MASK = (1 << NODES) - 1
+
+# 一个学期最多的周数，查询的周次不能超过它
+MAX_WEEK = 30
+
+
+def get_week_mask(start_week: int, end_week: int) -> int:
+    """
+    上课周次的位图，第 n 周对应第 n 位
+    :param start_week:
+    :param end_week:
+    :return:
+    """
+    return ((1 << (end_week + 1)) - 1) ^ ((1 << start_week) - 1)
+
+
+def get_slot_mask(weekday: int, start_node: int, end_node: int) -> int:
+    """
+    一周内上课节次的位图，星期 d 第 n 节对应第 (d - 1) * NODES + n - 1 位
+    :param weekday:
+    :param start_node:
+    :param end_node:
+    :return:
+    """
+    return ((((1 << (end_node - start_node + 1)) - 1) << (start_node - 1)) & DAY_MASK) << ((weekday - 1) * NODES)
+
+
+def get_index(user_id: int, school_year: int, semester: int, section_ids: list, version: str) -> list:
+    """
+    获取课程表的位图索引
+
+    索引与课程表版本号一起缓存，版本号变化后重新生成
+
+    :param user_id:
+    :param school_year:
+    :param semester:
+    :param section_ids:
+    :param version: 课程表版本号
+    :return: [(上课时间段 id, 周次位图, 节次位图)]
+    """
+    cache = redis.get(f'class-schedule-index-{school_year}-{semester}-{user_id}')
+
+    if cache is not None:
+        cache_version, _, entries = cache.decode('utf-8').partition('|')
+        if cache_version == version:
+            return [tuple(int(item, 16) for item in entry.split(':')) for entry in entries.split(',') if entry]
+
+    sections = {section.id: section for section in CourseSection.query.filter(CourseSection.id.in_(section_ids))}
+
+    index = []
+    for section_id in section_ids:
+        section = sections.get(section_id)
+        if section is not None:
+            index.append((
+                section_id,
+                get_week_mask(section.start_week, section.end_week),
+                get_slot_mask(section.weekday, section.start_node, section.end_node)
+            ))
+
+    entries = ','.join(f'{section_id:x}:{week_mask:x}:{slot_mask:x}' for section_id, week_mask, slot_mask in index)
+    redis.set(f'class-schedule-index-{school_year}-{semester}-{user_id}', f'{version}|{entries}')
+
+    return index
+
+
+def get_week_sections(index: list, week: int) -> list:
+    """
+    第 week 周要上的课
+    :param index:
+    :param week:
+    :return: 上课时间段 id，周次不在 1 到 MAX_WEEK 之间时为空
+    """
+    if not 1 <= week <= MAX_WEEK:
+        return []
+
+    week_bit = 1 << week
+    return [section_id for section_id, week_mask, _ in index if week_mask & week_bit]
+
+
+def get_day_sections(index: list, week: int, weekday: int, node: int = None) -> dict:
+    """
+    某一天要上的课，按开始节次排序
+
+    传入 node 时，同时找出第 node 节正在上的课，以及之后最早开始的课
+
+    :param index:
+    :param week:
+    :param weekday:
+    :param node: 当前节次，1 到 NODES
+    :return: {'sections': 上课时间段 id, 'current': 正在上的课的下标, 'next': 下一节课的下标}
+    """
+    if not 1 <= week <= MAX_WEEK:
+        return {'sections': [], 'current': [], 'next': []}
+
+    week_bit = 1 << week
+    shift = (weekday - 1) * NODES
+
+    today = []
+    for section_id, week_mask, slot_mask in index:
+        day_mask = (slot_mask >> shift) & DAY_MASK
+        if week_mask & week_bit and day_mask:
+
+            # 最低位即为开始节次
+            today.append(((day_mask & -day_mask).bit_length(), day_mask, section_id))
+
+    today.sort()
+
+    current, upcoming = [], []
+    if node is not None:
+        node_bit = 1 << (node - 1)
+        current = [i for i, (_, day_mask, _) in enumerate(today) if day_mask & node_bit]
+
+        later = [start_node for start_node, _, _ in today if start_node > node]
+        if later:
+            upcoming = [i for i, (start_node, _, _) in enumerate(today) if start_node == later[0]]
+
+    return {'sections': [section_id for _, _, section_id in today], 'current': current, 'next': upcoming}
+
+
+def get_week_now(school_opens_timestamp: int, today: date = None) -> tuple:
+    """
+    根据开学时间计算今天是第几周、星期几
+    :param school_opens_timestamp: 开学时间，毫秒
+    :param today:
+    :return: 周次, 星期，开学前周次小于 1
+    """
+    if today is None:
+        today = date.today()
+
+    days = (today - datetime.fromtimestamp(school_opens_timestamp / 1000).date()).days
+    return days // 7 + 1, today.isoweekday()
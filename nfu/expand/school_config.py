@@ -0,0 +1,80 @@
+from time import monotonic, time
+
+from flask import current_app
+
+from nfu.extensions import redis
+
+# 进程内缓存，{'expires': 过期时间, 'config': 学年配置}
+__cache = {'expires': 0, 'config': None}
+
+
+def get_config() -> dict:
+    """
+    获取当前学年学期等基本配置
+
+    配置保存在 Redis，进程内缓存 SCHOOL_CONFIG_CACHE_SECONDS 秒；
+    预先设置的下学期配置到了切换时间后自动生效
+
+    :return:
+    """
+    if __cache['config'] is not None and __cache['expires'] > monotonic():
+        return __cache['config']
+
+    pipe = redis.pipeline()
+    pipe.hgetall('school-config')
+    pipe.hgetall('school-config-next')
+    config, config_next = pipe.execute()
+
+    config = decode(config) or dict(current_app.config['SCHOOL_CONFIG'])
+    config_next = decode(config_next)
+
+    # 到了切换时间，下学期的配置生效
+    if config_next and config_next.pop('switchTimestamp') <= time() * 1000:
+        config = config_next
+
+        with redis.batch(transaction=True) as pipe:
+            pipe.hmset('school-config', config)
+            pipe.delete('school-config-next')
+
+    __cache['config'] = config
+    __cache['expires'] = monotonic() + current_app.config['SCHOOL_CONFIG_CACHE_SECONDS']
+
+    return config
+
+
+def get_next_config():
+    """
+    获取预先设置的下学期配置
+    :return: 没有设置时返回 None
+    """
+    return decode(redis.hgetall('school-config-next'))
+
+
+def set_config(school_year: int, semester: int, school_opens_timestamp: int, switch_timestamp: int = None) -> None:
+    """
+    修改学年配置
+    :param school_year:
+    :param semester:
+    :param school_opens_timestamp: 开学时间，毫秒
+    :param switch_timestamp: 切换时间，毫秒，为 None 时立即生效
+    :return:
+    """
+    config = {'schoolYear': school_year, 'semester': semester, 'schoolOpensTimestamp': school_opens_timestamp}
+
+    if switch_timestamp is None:
+        with redis.batch(transaction=True) as pipe:
+            pipe.hmset('school-config', config)
+            pipe.delete('school-config-next')
+    else:
+        redis.hmset('school-config-next', {**config, 'switchTimestamp': switch_timestamp})
+
+    __cache['expires'] = 0
+
+
+def decode(config: dict) -> dict:
+    """
+    把 Redis 中的哈希转换成整数
+    :param config:
+    :return:
+    """
+    return {field.decode('utf-8'): int(value) for field, value in config.items()}
@@ -0,0 +1,102 @@
+from flask import current_app
+
+from nfu.expand.metrics import incr
+from nfu.expand.reference import reference
+from nfu.extensions import redis
+from nfu.models import BusUser, User
+from nfu.nfu_error import NFUError
+
+
+def write_session(user) -> tuple:
+    """
+    把签发令牌需要的用户信息写入缓存，刷新令牌时不再查询数据库
+    :param user:
+    :return: 宿舍, 是否有校车权限
+    """
+    dormitory = reference.get_dormitory_name(user.room_id)
+
+    with redis.batch() as pipe:
+        __write(pipe, user, dormitory)
+        pipe.set(f'jw-{user.id}', user.jw_pwd)
+
+    return dormitory, __write_bus_power(user.id)
+
+
+def load_session(user_id: int) -> tuple:
+    """
+    读取签发令牌需要的用户信息，缓存没有时查询数据库并写入缓存
+
+    校车权限直接在数据库中增删，没有统一的入口可以清除缓存，
+    所以单独缓存，有效期只有 BUS_POWER_CACHE_TTL
+
+    :param user_id:
+    :return: 用户, 宿舍, 是否有校车权限
+    """
+    pipe = redis.pipeline()
+    pipe.hgetall(__key(user_id))
+    pipe.get(__bus_power_key(user_id))
+    session, bus_power = pipe.execute()
+
+    try:
+        user = User(
+            id=user_id,
+            name=session[b'name'].decode('utf-8'),
+            room_id=int(session[b'roomId']),
+            email=session[b'email'].decode('utf-8')
+        )
+        dormitory = session[b'dormitory'].decode('utf-8')
+
+    # 缓存不存在或者字段不全
+    except (KeyError, ValueError):
+        user = User.query.get(user_id)
+
+        # 用户已被删除
+        if user is None:
+            raise NFUError('请重新登录', code='1001')
+
+        dormitory = reference.get_dormitory_name(user.room_id)
+
+        with redis.batch() as pipe:
+            __write(pipe, user, dormitory)
+            incr('session-miss', pipe=pipe)
+
+    else:
+        incr('session-hit')
+
+    if bus_power is None:
+        bus_power = __write_bus_power(user_id)
+
+    return user, dormitory, int(bus_power)
+
+
+def delete_session(user_id: int) -> None:
+    """
+    用户信息或校车权限修改后删除缓存，下次刷新令牌时重新读取
+    :param user_id:
+    :return:
+    """
+    redis.delete(__key(user_id), __bus_power_key(user_id))
+
+
+def __key(user_id) -> str:
+    return f'user-{user_id}'
+
+
+def __bus_power_key(user_id) -> str:
+    return f'bus-power-{user_id}'
+
+
+def __write(pipe, user, dormitory: str) -> None:
+    pipe.hmset(__key(user.id), {
+        'name': user.name,
+        'roomId': user.room_id,
+        'email': user.email,
+        'dormitory': dormitory
+    })
+    pipe.expire(__key(user.id), current_app.config['SESSION_CACHE_TTL'])
+
+
+def __write_bus_power(user_id: int) -> int:
+    bus_power = int(BusUser.query.get(user_id) is not None)
+    redis.set(__bus_power_key(user_id), bus_power, ex=current_app.config['BUS_POWER_CACHE_TTL'])
+    return bus_power
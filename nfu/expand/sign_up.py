@@ -0,0 +1,199 @@
+from json import dumps, loads
+from time import monotonic, sleep
+from uuid import uuid4
+
+from flask import current_app
+from redis import RedisError
+
+from nfu.expand.email import send_validate_email
+from nfu.expand.metrics import incr
+from nfu.expand.nfu import get_student_name
+from nfu.expand.token import generate_token
+from nfu.extensions import redis
+from nfu.nfu_error import NFUError
+
+# 等待处理的注册任务，从左边放入，从右边取出
+QUEUE_KEY = 'sign-up-queue'
+
+# 任务进程正在处理的注册任务，处理完才删除，进程中途退出时由同名的进程放回队列
+PROCESSING_KEY = 'sign-up-processing-{}'
+
+# 取任务时 Redis 出错，等待多久再重试
+RETRY_INTERVAL = 1
+
+# 等待任务完成时，每次检查状态的间隔
+WAIT_INTERVAL = 0.2
+
+
+def enqueue(user_id: int, password: str, room_id: int, email: str) -> str:
+    """
+    提交注册任务
+
+    同一学号只处理最后提交的任务，之前未开始的任务轮到时直接标记为失败，
+    后提交的人不会拿到先提交者（密码、邮箱可能不同）的任务结果；
+    注册信息只放在队列中，任务状态中没有密码
+
+    :param user_id:
+    :param password: 教务系统的密码
+    :param room_id:
+    :param email:
+    :return: 任务 id
+    """
+    ttl = current_app.config['SIGN_UP_JOB_TTL']
+    job_id = uuid4().hex
+
+    with redis.batch() as pipe:
+        pipe.set(f'sign-up-pending-{user_id}', job_id, ex=ttl)
+        pipe.hmset(f'sign-up-job-{job_id}', {'status': 'pending', 'userId': user_id})
+        pipe.expire(f'sign-up-job-{job_id}', ttl)
+        pipe.lpush(QUEUE_KEY, dumps({
+            'jobId': job_id,
+            'userId': user_id,
+            'password': password,
+            'roomId': room_id,
+            'email': email
+        }))
+
+    return job_id
+
+
+def get_job(job_id: str, wait: float = 0):
+    """
+    查询任务状态
+    :param job_id:
+    :param wait: 任务未完成时最多等待的秒数
+    :return: {'status': pending | running | done | failed, 'code': 错误码, 'message': 错误信息}，任务不存在时返回 None
+    """
+    deadline = monotonic() + wait
+
+    while True:
+        job = redis.hgetall(f'sign-up-job-{job_id}')
+        if not job:
+            return None
+
+        job = {field.decode('utf-8'): value.decode('utf-8') for field, value in job.items()}
+        if job['status'] in ('done', 'failed') or monotonic() >= deadline:
+            job.pop('userId', None)
+            return job
+
+        sleep(WAIT_INTERVAL)
+
+
+def work(name: str, timeout: int = 5):
+    """
+    不断从队列取出注册任务并处理
+
+    取出的任务先移到本进程的处理中列表，处理完才删除；
+    进程中途退出时，重启后先把上次没处理完的任务放回队列
+
+    :param name: 任务进程名，同时运行的多个进程不能重名
+    :param timeout: 队列为空时每次阻塞等待的秒数
+    :return: 每处理完一个任务产出一次 (任务 id, 状态)
+    """
+    processing_key = PROCESSING_KEY.format(name)
+
+    while redis.rpoplpush(processing_key, QUEUE_KEY) is not None:
+        pass
+
+    while True:
+        try:
+            item = redis.brpoplpush(QUEUE_KEY, processing_key, timeout=timeout)
+        except RedisError:
+            current_app.logger.exception('读取注册任务队列失败')
+            sleep(RETRY_INTERVAL)
+            continue
+
+        if item is None:
+            continue
+
+        try:
+            job = loads(item)
+            status = run(job)
+
+        # 出现意外的错误时让客户端知道失败了，记录下来后继续处理下一个任务
+        except Exception:
+            current_app.logger.exception('注册任务处理失败')
+            job, status = __fail(item), 'error'
+
+        # 删除失败时任务留在处理中列表，下次启动放回队列后按已完成跳过
+        try:
+            redis.lrem(processing_key, 1, item)
+        except RedisError:
+            current_app.logger.exception('删除已处理的注册任务失败')
+
+        if job is not None:
+            yield job['jobId'], status
+
+
+def run(job: dict) -> str:
+    """
+    处理注册任务：向教务系统校对账号密码，发送激活邮件，并把注册信息写入缓存
+    :param job:
+    :return: 任务的最终状态
+    """
+    job_key = f"sign-up-job-{job['jobId']}"
+
+    pipe = redis.pipeline()
+    pipe.hget(job_key, 'status')
+    pipe.get(f"sign-up-pending-{job['userId']}")
+    status, latest_id = pipe.execute()
+
+    # 任务已过期，客户端不会再来查询
+    if status is None:
+        return 'expired'
+
+    # 上次处理到一半时进程退出，放回队列前已经处理完
+    if status in (b'done', b'failed'):
+        return status.decode('utf-8')
+
+    # 同一学号之后又提交了注册
+    if latest_id is None or latest_id.decode('utf-8') != job['jobId']:
+        redis.hmset(job_key, {'status': 'failed', 'code': '2000', 'message': '该学号已重新提交注册，请以最新的结果为准'})
+        return 'superseded'
+
+    redis.hset(job_key, 'status', 'running')
+
+    # 如果正确获得学生姓名，默认代表该用户拥有该账号合法性
+    try:
+        name = get_student_name(job['userId'], job['password'])
+    except NFUError as err:
+        with redis.batch() as pipe:
+            pipe.hmset(job_key, {'status': 'failed', 'code': err.code, 'message': err.message})
+            incr('sign-up-failed', pipe=pipe)
+
+        return 'failed'
+
+    token = generate_token({'id': job['userId']}, token_type='EMAIL_TOKEN')
+    send_validate_email(job['email'], name, job['userId'], token)
+
+    # 把帐号资料写入缓存，并设置缓存一小时过期
+    with redis.batch() as pipe:
+        pipe.hmset(f"sign-up-{job['userId']}", {
+            'name': name,
+            'password': job['password'],
+            'roomId': job['roomId'],
+            'email': job['email']
+        })
+        pipe.expire(f"sign-up-{job['userId']}", 3600)
+        pipe.hmset(job_key, {'status': 'done', 'code': '1000', 'message': '激活邮件已发送至您的邮箱，请查看'})
+        incr('sign-up-done', pipe=pipe)
+
+    return 'done'
+
+
+def __fail(item: bytes):
+    """
+    处理出错的任务标记为失败
+    :param item: 队列中的任务
+    :return: 任务，无法解析时返回 None
+    """
+    try:
+        job = loads(item)
+        with redis.batch() as pipe:
+            pipe.hmset(f"sign-up-job-{job['jobId']}", {'status': 'failed', 'code': '2000', 'message': '服务器内部错误'})
+            incr('sign-up-error', pipe=pipe)
+    except (ValueError, KeyError, TypeError, RedisError):
+        current_app.logger.exception('无法标记失败的注册任务')
+        return None
+
+    return job
@@ -0,0 +1,84 @@
+from json import dumps, loads
+from time import sleep, time
+
+from flask import current_app
+from redis.exceptions import LockError
+
+from nfu.extensions import redis
+from nfu.nfu_error import NFUError
+
+# 等待其他请求同步时，每次检查结果的间隔
+WAIT_INTERVAL = 0.1
+
+
+def coalesce(name: str, user_id: int, func):
+    """
+    合并同一学生同一类数据的同步请求
+
+    - 距离上次成功同步不足 SYNC_MIN_INTERVAL 秒时，直接返回上次的结果
+    - 已有请求正在同步时，等待它完成并返回它的结果，不再重复请求教务系统
+    - 正在进行的同步出错时，等待的请求得到同样的错误
+
+    :param name: 数据类型
+    :param user_id:
+    :param func: 没有参数的同步函数，返回值需要能被 JSON 序列化
+    :return: func 的返回值
+    """
+    result_key = f'sync-result-{name}-{user_id}'
+    start = time()
+
+    result = __read(result_key)
+    if result is not None and 'value' in result and start - result['time'] < current_app.config['SYNC_MIN_INTERVAL']:
+        return result['value']
+
+    lock_timeout = current_app.config['SYNC_LOCK_TIMEOUT']
+    lock = redis.lock(f'sync-lock-{name}-{user_id}', timeout=lock_timeout)
+
+    while not lock.acquire(blocking=False):
+        sleep(WAIT_INTERVAL)
+
+        # 正在进行的同步已完成
+        result = __read(result_key)
+        if result is not None and result['time'] >= start:
+            return __unwrap(result)
+
+        # 持有锁的请求可能已经崩溃，不再等待
+        if time() - start > lock_timeout:
+            break
+
+    try:
+
+        # 拿到锁之前，其他请求可能刚完成同步
+        result = __read(result_key)
+        if result is not None and result['time'] >= start:
+            return __unwrap(result)
+
+        value = func()
+    except NFUError as err:
+        __write(result_key, {'time': time(), 'error': [err.code, err.message]})
+        raise
+    else:
+        __write(result_key, {'time': time(), 'value': value})
+        return value
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass
+
+
+def __read(key: str):
+    result = redis.get(key)
+    return None if result is None else loads(result)
+
+
+def __write(key: str, result: dict) -> None:
+    expire = max(current_app.config['SYNC_MIN_INTERVAL'], current_app.config['SYNC_LOCK_TIMEOUT'])
+    redis.set(key, dumps(result), ex=expire)
+
+
+def __unwrap(result: dict):
+    if 'error' in result:
+        raise NFUError(result['error'][1], code=result['error'][0])
+
+    return result['value']
@@ -1,32 +1,146 @@
-from json import dumps
+import hmac
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import sha256
+from json import dumps, loads
 from os import getenv
+from time import time
 
 from itsdangerous import BadSignature, SignatureExpired, TimedJSONWebSignatureSerializer
 
-from nfu.models import BusUser, Dormitory
 from nfu.nfu_error import NFUError
 
 
-def write_access_token_redis_cache(r, user) -> tuple:
+class TokenEngine:
     """
-    写入 redis 缓存
-    :param r:
-    :param user:
+    令牌的签发与验证
+
+    令牌仍是 JWS 格式 header.payload.signature，客户端可以照旧解码 payload：
+    header 中带上 kid 标识签名所用的密钥，签名为 HMAC-SHA256，过期时间与原来一样放在 header 的 exp 中。
+    轮换时新密钥放在最前面用于签发，旧密钥保留到旧令牌全部过期。
+
+    header 中没有 kid 的是原来 TimedJSONWebSignatureSerializer 签发的令牌，过渡期内仍然接受
+    """
+    algorithm = 'HS256'
+
+    def __init__(self, keys: dict, legacy_key: str = None):
+        """
+        :param keys: {kid: 密钥}，第一个用于签发
+        :param legacy_key: 原来的密钥，为 None 时不再接受旧令牌
+        """
+        for kid in keys:
+            if not kid:
+                raise ValueError('kid 不能为空')
+
+        self.kid = next(iter(keys))
+        self.macs = {kid: hmac.new(secret.encode('utf-8'), digestmod=sha256) for kid, secret in keys.items()}
+        self.legacy = None if legacy_key is None else TimedJSONWebSignatureSerializer(legacy_key)
+
+    def dumps(self, data: dict, expires_in: int) -> str:
+        """
+        签发令牌
+        :param data: 令牌的内容
+        :param expires_in: 有效时间，秒
+        :return:
+        """
+        now = int(time())
+        header = self.__encode({'alg': self.algorithm, 'kid': self.kid, 'iat': now, 'exp': now + expires_in})
+
+        signing_input = f'{header}.{self.__encode(data)}'
+        return f'{signing_input}.{self.__sign(self.kid, signing_input)}'
+
+    def loads(self, token: str) -> dict:
+        """
+        验证令牌
+        :param token:
+        :return: 令牌的内容
+        :raise SignatureExpired: 令牌已过期
+        :raise BadSignature: 令牌无效
+        """
+        parts = token.split('.')
+        if len(parts) != 3 or not token.isascii():
+            raise BadSignature('令牌格式错误')
+
+        header = self.__decode(parts[0])
+        if not isinstance(header, dict):
+            raise BadSignature('令牌格式错误')
+
+        if 'kid' not in header and self.legacy is not None:
+            return self.__flatten(self.legacy.loads(token))
+
+        kid = header.get('kid')
+        if header.get('alg') != self.algorithm or kid not in self.macs:
+            raise BadSignature('令牌格式错误')
+
+        if not hmac.compare_digest(self.__sign(kid, token.rpartition('.')[0]), parts[2]):
+            raise BadSignature('签名错误')
+
+        if not isinstance(header.get('exp'), int) or header['exp'] < time():
+            raise SignatureExpired('签名已过期')
+
+        data = self.__decode(parts[1])
+        if not isinstance(data, dict):
+            raise BadSignature('令牌格式错误')
+
+        return self.__flatten(data)
+
+    def __sign(self, kid: str, signing_input: str) -> str:
+
+        # 复制预先初始化好的 HMAC，省去每次重新处理密钥
+        mac = self.macs[kid].copy()
+        mac.update(signing_input.encode('ascii'))
+        return self.__b64encode(mac.digest())
+
+    @staticmethod
+    def __flatten(data: dict) -> dict:
+
+        # 访问令牌把用户信息再序列化一次放在 data 中（客户端按这个结构读取），服务端展开后使用
+        if isinstance(data.get('data'), str):
+            data = {**loads(data['data']), **data}
+
+        return data
+
+    def __encode(self, obj: dict) -> str:
+        return self.__b64encode(dumps(obj, separators=(',', ':')).encode('ascii'))
+
+    def __decode(self, s: str):
+        try:
+            return loads(urlsafe_b64decode(s + '=' * (-len(s) % 4)))
+        except ValueError:
+            raise BadSignature('令牌格式错误')
+
+    @staticmethod
+    def __b64encode(raw: bytes) -> str:
+        return urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+# 每种令牌一个 TokenEngine，进程内只创建一次
+__engines = {}
+
+
+def get_engine(token_type: str) -> TokenEngine:
+    """
+    获取令牌类型对应的 TokenEngine
+
+    密钥从环境变量 {token_type}_KEYS 读取，格式为 "kid:密钥,kid:密钥"，第一个用于签发；
+    没有配置时使用环境变量 {token_type} 作为 kid 为 0 的密钥。
+    TOKEN_ACCEPT_LEGACY 不为 false 时，仍接受用环境变量 {token_type} 签发的旧令牌
+
+    :param token_type: 令牌的类型，每一个类型对应不同的密钥
     :return:
     """
-    dormitory_db = Dormitory.query.get(user.room_id)
-    dormitory = f'{dormitory_db.building} {dormitory_db.floor} {dormitory_db.room}'
-    bus_power = int(BusUser.query.get(user.id) is not None)
-    r.hmset(f"user-{user.room_id}", {
-        'name': user.name,
-        'roomId': user.room_id,
-        'email': user.email,
-        'dormitory': dormitory,
-        'busPower': bus_power,
-    })
-    r.set(f"jw-{user.id}", user.jw_pwd)
+    engine = __engines.get(token_type)
+
+    if engine is None:
+        keys_env = getenv(f'{token_type}_KEYS')
+        if keys_env:
+            keys = dict(item.strip().split(':', 1) for item in keys_env.split(','))
+        else:
+            keys = {'0': getenv(token_type)}
+
+        accept_legacy = getenv('TOKEN_ACCEPT_LEGACY', 'true').lower() != 'false'
+        engine = __engines[token_type] = TokenEngine(keys, getenv(token_type) if accept_legacy else None)
 
-    return dormitory, bus_power
+    return engine
 
 
 def create_access_token(user, dormitory, busPower) -> dict:
@@ -61,9 +175,7 @@ def generate_token(data: dict, *, token_type: str = 'ACCESS_TOKEN', expires_in:
     :param expires_in: 有效时间
     :return: 令牌
     """
-    s = TimedJSONWebSignatureSerializer(getenv(token_type), expires_in=expires_in)
-    token = s.dumps(data).decode('ascii')
-    return token
+    return get_engine(token_type).dumps(data, expires_in)
 
 
 def validate_token(token: str, token_type: str = 'ACCESS_TOKEN') -> dict:
@@ -72,9 +184,8 @@ def validate_token(token: str, token_type: str = 'ACCESS_TOKEN') -> dict:
     :param token: 令牌
     :param token_type: 令牌类型
     """
-    s = TimedJSONWebSignatureSerializer(getenv(token_type))
     try:
-        data = s.loads(token)
+        data = get_engine(token_type).loads(token)
     except SignatureExpired:
         raise NFUError('签名已过期', code='1001')
     except BadSignature:
@@ -1,7 +1,33 @@
-from nfu.expand.nfu import get_jw_token, get_total_achievement_point
-from nfu.extensions import db
+from hashlib import md5
+from json import dumps
+
+from nfu.expand.cache import ReadThroughCache
+from nfu.expand.nfu import call_with_jw_token, get_total_achievement_point
+from nfu.expand.rank import update_rank
+from nfu.extensions import db, redis
 from nfu.models import TotalAchievements
 
+total_cache = ReadThroughCache('total-achievement-cache')
+
+
+def get_total(user) -> dict:
+    """
+    获取总体成绩，依次查缓存、数据库、教务系统
+    :param user: 有 id 和 jw_pwd 的用户，需要访问教务系统时才读取 jw_pwd
+    :return:
+    """
+
+    def loader():
+        achievement_db = TotalAchievements.query.get(user.id)
+
+        # 数据库存在数据
+        if achievement_db:
+            return achievement_db.get_dict()
+
+        return db_init_total(user.id, user.jw_pwd)
+
+    return total_cache.get(total_cache.key(user.id), loader)
+
 
 def db_init_total(user_id: int, jw_pwd: str) -> dict:
     """
@@ -10,7 +36,7 @@ def db_init_total(user_id: int, jw_pwd: str) -> dict:
     :param user_id:
     :return:
     """
-    total_achievement_data = get_total_achievement_point(get_jw_token(user_id, jw_pwd))
+    total_achievement_data = call_with_jw_token(user_id, jw_pwd, get_total_achievement_point)
 
     db.session.add(TotalAchievements(
         user_id=user_id,
@@ -21,14 +47,21 @@ def db_init_total(user_id: int, jw_pwd: str) -> dict:
     ))
 
     db.session.commit()
+    update_rank(user_id, total_achievement_data['average_achievement_point'])
 
-    return {
+    total_achievement = {
         'getCredit': total_achievement_data['get_credit'],
         'selectedCredit': total_achievement_data['selected_credit'],
         'averageAchievement': total_achievement_data['average_achievement'],
         'averageAchievementPoint': total_achievement_data['average_achievement_point']
     }
 
+    with redis.batch() as pipe:
+        pipe.set(f'total-achievement-version-{user_id}', get_total_version(total_achievement))
+        total_cache.set(total_cache.key(user_id), total_achievement, pipe)
+
+    return total_achievement
+
 
 def db_update_total(user_id: int, jw_pwd: str) -> dict:
     """
@@ -37,7 +70,7 @@ def db_update_total(user_id: int, jw_pwd: str) -> dict:
     :param user_id:
     :return:
     """
-    total_achievement_data = get_total_achievement_point(get_jw_token(user_id, jw_pwd))
+    total_achievement_data = call_with_jw_token(user_id, jw_pwd, get_total_achievement_point)
 
     achievement_db = TotalAchievements.query.get(user_id)
     achievement_db.get_credit = total_achievement_data['get_credit']
@@ -47,10 +80,26 @@ def db_update_total(user_id: int, jw_pwd: str) -> dict:
 
     db.session.add(achievement_db)
     db.session.commit()
+    update_rank(user_id, total_achievement_data['average_achievement_point'])
 
-    return {
+    total_achievement = {
         'getCredit': total_achievement_data['get_credit'],
         'selectedCredit': total_achievement_data['selected_credit'],
         'averageAchievement': total_achievement_data['average_achievement'],
         'averageAchievementPoint': total_achievement_data['average_achievement_point']
     }
+
+    with redis.batch() as pipe:
+        pipe.set(f'total-achievement-version-{user_id}', get_total_version(total_achievement))
+        total_cache.set(total_cache.key(user_id), total_achievement, pipe)
+
+    return total_achievement
+
+
+def get_total_version(total_achievement: dict) -> str:
+    """
+    总体成绩的版本号，用作 ETag
+    :param total_achievement:
+    :return:
+    """
+    return md5(dumps(total_achievement, sort_keys=True).encode(encoding='UTF-8')).hexdigest()
@@ -0,0 +1,70 @@
+from time import monotonic, sleep
+
+from flask import current_app
+
+from nfu.expand.class_schedule import get_sections, schedule_cache
+from nfu.expand.school_config import decode
+from nfu.extensions import redis
+from nfu.models import User
+from nfu.nfu_error import NFUError
+
+
+def warm_up(school_year: int, semester: int, batch_size: int = 100, rate: float = None, restart: bool = False):
+    """
+    换学期前，预先获取所有学生新学期的课程表，写入数据库与缓存
+
+    按学号顺序分批处理，进度记录在 Redis，中断后再次执行会从上次的位置继续；
+    每秒最多处理 rate 个学生，避免压垮教务系统
+
+    :param school_year:
+    :param semester:
+    :param batch_size: 每批读取的学生数
+    :param rate: 每秒最多处理的学生数，必须大于 0
+    :param restart: 是否忽略之前的进度从头开始
+    :return: 每处理完一批，生成一次进度
+    """
+    if rate is None:
+        rate = current_app.config['SEMESTER_WARMUP_RATE']
+
+    if rate <= 0:
+        raise ValueError(f'rate 必须大于 0：{rate}')
+
+    key = f'semester-warmup-{school_year}-{semester}'
+    if restart:
+        redis.delete(key)
+
+    progress = {'cursor': 0, 'done': 0, 'empty': 0, 'failed': 0, **decode(redis.hgetall(key))}
+    progress['total'] = User.query.filter(User.jw_pwd.isnot(None)).count()
+
+    interval = 1 / rate
+    while True:
+        users = User.query.with_entities(User.id, User.jw_pwd).filter(
+            User.id > progress['cursor'],
+            User.jw_pwd.isnot(None)
+        ).order_by(User.id).limit(batch_size).all()
+
+        if not users:
+            return
+
+        for user in users:
+            user_id = user.id
+            start = monotonic()
+
+            try:
+                section_ids, _ = get_sections(user, school_year, semester)
+            except NFUError:
+                progress['failed'] += 1
+            else:
+                if section_ids:
+                    progress['done'] += 1
+                else:
+
+                    # 教务系统可能还没有排好课，不缓存空课表，开学后按正常流程获取
+                    progress['empty'] += 1
+                    schedule_cache.delete(schedule_cache.key(school_year, semester, user_id))
+
+            progress['cursor'] = user_id
+            sleep(max(0.0, interval - (monotonic() - start)))
+
+        redis.hmset(key, {field: progress[field] for field in ('cursor', 'done', 'empty', 'failed')})
+        yield progress
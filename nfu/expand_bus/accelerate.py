@@ -1,11 +1,9 @@
 from json import dumps
-from os import getenv
 from random import randint
 
 from flask import g
-from redis import Redis
 
-from nfu.extensions import db
+from nfu.extensions import db, redis
 from nfu.models import TicketOrder
 
 
@@ -49,13 +47,11 @@ def put_redis(data: dict, order_id: str):
     :param order_id:
     :return:
     """
-    r = Redis(host='localhost', password=getenv('REDIS_PASSWORD'), port=6379)
-
     if data['orderType'] == 1:
         #
         # 判断订单时间
         #
-        r.hset(f'{data["ticketDate"]}_accelerate', order_id, dumps({
+        redis.hset(f'{data["ticketDate"]}_accelerate', order_id, dumps({
             'busId': data['busId'],
             'passengerIds': data['passengerIds'],
             'ticketDate': data['ticketDate'],
@@ -66,7 +62,7 @@ def put_redis(data: dict, order_id: str):
 
     # 刷票订单写入Redis
     if data['orderType'] == 2:
-        r.hset('accelerate_order', order_id, dumps({
+        redis.hset('accelerate_order', order_id, dumps({
             'busId': data['busId'],
             'passengerIds': data['passengerIds'],
             'ticketDate': data['ticketDate'],
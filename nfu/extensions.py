@@ -1,5 +1,61 @@
+from contextlib import contextmanager
+
 from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
+from redis import BlockingConnectionPool, StrictRedis
+
+
+class FlaskRedis:
+    """
+    Redis 拓展
+
+    整个应用共用一个连接池，避免每个请求都重新建立 TCP 连接与 AUTH 握手
+    """
+
+    def __init__(self, app=None):
+        self._client = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app) -> None:
+        """
+        根据配置创建连接池
+
+        连接数达到上限时等待其他请求归还连接，而不是直接报错，
+        gevent worker 中同时处理的请求数可能远多于连接数
+
+        :param app:
+        :return:
+        """
+        pool = BlockingConnectionPool(
+            timeout=app.config['REDIS_POOL_TIMEOUT'],
+            host=app.config['REDIS_HOST'],
+            port=app.config['REDIS_PORT'],
+            db=app.config['REDIS_DB'],
+            password=app.config['REDIS_PASSWORD'],
+            max_connections=app.config['REDIS_MAX_CONNECTIONS'],
+            socket_timeout=app.config['REDIS_SOCKET_TIMEOUT'],
+            socket_connect_timeout=app.config['REDIS_SOCKET_TIMEOUT']
+        )
+        self._client = StrictRedis(connection_pool=pool)
+        app.extensions['redis'] = self
+
+    @contextmanager
+    def batch(self, transaction: bool = False):
+        """
+        批量执行命令，with 代码块结束时一次性发送，只产生一次往返
+        :param transaction: 是否以 MULTI/EXEC 事务执行
+        :return:
+        """
+        pipe = self._client.pipeline(transaction=transaction)
+        yield pipe
+        pipe.execute()
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
 
 db = SQLAlchemy()
 mail = Mail()
+redis = FlaskRedis()
@@ -1,4 +1,4 @@
-from json import loads
+from json import dumps, loads
 
 from werkzeug.security import check_password_hash
 
@@ -46,8 +46,10 @@ class Electric(db.Model):
     """
     电费表
     """
+    __table_args__ = (db.Index('room_date', 'room_id', 'date', 'value'),)
+
     id = db.Column(db.Integer, primary_key=True)
-    room_id = db.Column(db.Integer, index=True)
+    room_id = db.Column(db.Integer)
     value = db.Column(db.Float)
     date = db.Column(db.Date)
 
@@ -75,6 +77,8 @@ class Achievement(db.Model):
     """
     成绩表
     """
+    __table_args__ = (db.Index('user_semester', 'user_id', 'school_year', 'semester'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer)
     school_year = db.Column(db.Integer)
@@ -146,25 +150,40 @@ class College(db.Model):
     college = db.Column(db.String)
 
 
-class ClassSchedule(db.Model):
+class CourseSection(db.Model):
     """
-    课程表
+    教学班的上课时间段，同一教学班的同学共用
     """
+    __table_args__ = (db.Index(
+        'section',
+        'school_year',
+        'semester',
+        'course_id',
+        'weekday',
+        'start_node',
+        'end_node',
+        'start_week',
+        'end_week',
+        unique=True
+    ),)
+
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer)
     school_year = db.Column(db.Integer)
     semester = db.Column(db.Integer)
-    subdivision_type = db.Column(db.String)
-    course_name = db.Column(db.String)
     course_id = db.Column(db.String)
-    credit = db.Column(db.Float)
-    teacher = db.Column(db.String)
-    classroom = db.Column(db.String)
     weekday = db.Column(db.Integer)
     start_node = db.Column(db.Integer)
     end_node = db.Column(db.Integer)
     start_week = db.Column(db.Integer)
     end_week = db.Column(db.Integer)
+    subdivision_type = db.Column(db.String)
+    course_name = db.Column(db.String)
+    credit = db.Column(db.Float)
+    teacher = db.Column(db.String)
+    classroom = db.Column(db.String)
+
+    def get_key(self) -> tuple:
+        return self.course_id, self.weekday, self.start_node, self.end_node, self.start_week, self.end_week
 
     def get_dict(self):
         return {
@@ -181,11 +200,44 @@ class ClassSchedule(db.Model):
             'endWeek': self.end_week
         }
 
+    def get_json(self) -> str:
+        """
+        与 get_dict 内容相同的 JSON，teacher 字段本身就是 JSON，直接拼接
+        :return:
+        """
+        return dumps({
+            'courseId': self.course_id,
+            'courseType': self.subdivision_type,
+            'courseName': self.course_name,
+            'credit': self.credit,
+            'classroom': self.classroom,
+            'weekday': self.weekday,
+            'startNode': self.start_node,
+            'endNode': self.end_node,
+            'startWeek': self.start_week,
+            'endWeek': self.end_week
+        })[:-1] + f', "teacher": {self.teacher}}}'
+
+
+class ClassSchedule(db.Model):
+    """
+    课程表，只记录学生选了哪些教学班的上课时间段
+    """
+    __table_args__ = (db.Index('user_semester', 'user_id', 'school_year', 'semester'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer)
+    school_year = db.Column(db.Integer)
+    semester = db.Column(db.Integer)
+    section_id = db.Column(db.Integer)
+
 
 class TicketOrder(db.Model):
     """
     车票订单
     """
+    __table_args__ = (db.Index('user_ticket', 'user_id', 'ticket_date', 'bus_ids'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer)
     bus_ids = db.Column(db.Integer)
@@ -5,3 +5,11 @@ from dataclasses import dataclass
 class NFUError(Exception):
     message: str
     code: str = '2000'
+
+
+@dataclass
+class JWTokenRejected(NFUError):
+    """
+    教务系统拒绝了令牌，通常是缓存的令牌已被注销
+    """
+    message: str = '教务系统登录已失效，请稍后再试'
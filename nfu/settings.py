@@ -9,3 +9,95 @@ MAIL_USE_SSL = True
 MAIL_USERNAME = getenv('MAIL_USERNAME')
 MAIL_PASSWORD = getenv('MAIL_PASSWORD')
 MAIL_DEFAULT_SENDER = ('南苑聚合', MAIL_USERNAME)
+
+REDIS_HOST = getenv('REDIS_HOST', 'localhost')
+REDIS_PORT = int(getenv('REDIS_PORT', 6379))
+REDIS_DB = int(getenv('REDIS_DB', 0))
+REDIS_PASSWORD = getenv('REDIS_PASSWORD')
+REDIS_MAX_CONNECTIONS = int(getenv('REDIS_MAX_CONNECTIONS', 64))
+REDIS_SOCKET_TIMEOUT = 5
+
+# 连接池用完时等待空闲连接的秒数，超时才报错
+REDIS_POOL_TIMEOUT = 5
+
+# 同步成绩单时并发请求的学期数，设为 1 则逐个学期请求
+ACHIEVEMENT_FETCH_CONCURRENCY = int(getenv('ACHIEVEMENT_FETCH_CONCURRENCY', 4))
+
+# 教务系统各接口的 (单次请求超时, 总时限)，未配置的接口使用 JWClient 的默认值
+JW_TIMEOUTS = {}
+JW_MAX_ATTEMPTS = 6
+
+# 增量更新成绩单时，最近多少天内有变动的学期仍会重新请求
+ACHIEVEMENT_RECENT_DAYS = 30
+
+# Redis 中没有学年配置时使用的默认值，之后通过 flask school-config 修改
+SCHOOL_CONFIG = {
+    'schoolYear': 2020,
+    'semester': 2,
+    'schoolOpensTimestamp': 1614528000000
+}
+
+# 学年配置在进程内缓存的秒数
+SCHOOL_CONFIG_CACHE_SECONDS = 30
+
+# 换学期预热课程表时，每秒最多处理的学生数
+SEMESTER_WARMUP_RATE = float(getenv('SEMESTER_WARMUP_RATE', 5))
+
+# 读穿缓存各类数据的 (有效期, 过期后仍可先返回旧数据的时间)，单位为秒，
+# 键为缓存名，如 {'profile-cache': (86400, 86400)}，未配置的使用 ReadThroughCache 创建时的默认值
+CACHE_TTLS = {}
+
+# 教务系统出错时，错误信息的缓存时间
+CACHE_ERROR_TTL = 30
+
+# 加载缓存时锁的超时时间，应大于教务系统接口的总时限
+CACHE_LOCK_TIMEOUT = 30
+
+# 同一学生同一类数据两次真正向教务系统同步的最小间隔，单位为秒，间隔内的更新请求直接返回上次的结果
+SYNC_MIN_INTERVAL = int(getenv('SYNC_MIN_INTERVAL', 60))
+
+# 同步锁的超时时间，应大于一次同步的最长耗时
+SYNC_LOCK_TIMEOUT = 120
+
+# 启动时把宿舍、学院、专业表读入内存，配合 gunicorn --preload 由各 worker 共享
+REFERENCE_PRELOAD = getenv('REFERENCE_PRELOAD', 'true').lower() == 'true'
+
+# 用户信息缓存的有效期，与刷新令牌的有效期一致
+SESSION_CACHE_TTL = 2592000
+
+# 校车权限的缓存有效期，权限变化后最多这么久才反映到新的访问令牌中
+BUS_POWER_CACHE_TTL = 600
+
+# 密码哈希的算法与迭代次数，格式同 werkzeug 的 generate_password_hash，
+# 修改后旧的哈希在用户下次登录成功时自动升级
+PASSWORD_HASH_METHOD = getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:150000')
+
+# 每个 worker 计算密码哈希的进程数，为 0 时在 worker 内直接计算
+PASSWORD_POOL_SIZE = int(getenv('PASSWORD_POOL_SIZE', 2))
+
+# 每个 worker 最多同时等待计算的密码数，超过时直接返回繁忙
+PASSWORD_QUEUE_LIMIT = 32
+
+# 等待计算结果的最长时间，单位为秒
+PASSWORD_TIMEOUT = 10
+
+# 限流规则，{规则名: {维度: (窗口内最多请求数, 窗口秒数)}}，维度为 user（学号）或 ip
+# 校园网出口共用少数几个 IP，按 IP 的上限要留足余量
+RATE_LIMITS = {
+    'login': {'user': (10, 300), 'ip': (300, 300)},
+    'sign-up': {'user': (5, 3600), 'ip': (20, 3600)},
+    'update': {'user': (20, 600), 'ip': (200, 600)},
+}
+
+# 前面的反向代理层数，大于 0 时从 X-Forwarded-For 读取客户端 IP
+PROXY_COUNT = int(getenv('PROXY_COUNT', 0))
+
+# 是否按 IP 限流，在反向代理之后部署时先配置好 PROXY_COUNT 再打开，
+# 否则所有请求都来自代理的地址，按 IP 的上限就成了全站的上限
+RATE_LIMIT_BY_IP = getenv('RATE_LIMIT_BY_IP', 'false').lower() == 'true'
+
+# 注册任务的保存时间，单位为秒
+SIGN_UP_JOB_TTL = 3600
+
+# 查询注册任务时最多等待的秒数
+SIGN_UP_WAIT_MAX = 10